@@ -0,0 +1,74 @@
+"""
+Общая настройка тестов backend.
+Модули player_service, cache_service, features и routers.features в этом дереве могут отсутствовать;
+тогда вместо них подставляются заглушки без сети и Redis, а тесты подменяют нужные методы
+"""
+
+import os
+import sys
+import types
+import importlib.util
+
+# Спаны в тестах не выгружаются
+os.environ.setdefault("TRACE_EXPORTER", "none")
+
+
+class _PlayerServiceStub:
+    async def get_player_stats(self, username, region="en"):
+        return None
+
+    async def refresh_player_data(self, username, region="en"):
+        return None
+
+
+class _CacheServiceStub:
+    async def get_redis(self):
+        return None
+
+    async def get_top_players(self, region, limit):
+        return None
+
+    async def set_top_players(self, region, limit, players):
+        pass
+
+
+class _FeaturesServiceStub:
+    def realtime_combat_rating(self, kills, deaths, battles):
+        return round(kills / max(deaths, 1) * 100, 1)
+
+    def _compare_players(self, player1, player2):
+        return {}
+
+    def _generate_enemy_recommendation(self, comparison):
+        return ""
+
+
+def _router_module(name: str) -> types.ModuleType:
+    from fastapi import APIRouter
+
+    module = types.ModuleType(name)
+    module.router = APIRouter()
+    return module
+
+
+def _module_exists(module_name: str) -> bool:
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+def _install_stub(module_name: str, **attributes):
+    if _module_exists(module_name):
+        return
+    module = types.ModuleType(module_name)
+    module.__dict__.update(attributes)
+    sys.modules[module_name] = module
+
+
+_install_stub("services.player_service", player_service=_PlayerServiceStub())
+_install_stub("services.cache_service", cache_service=_CacheServiceStub())
+_install_stub("services.features", features_service=_FeaturesServiceStub())
+if not _module_exists("routers.features"):
+    sys.modules.setdefault("routers", types.ModuleType("routers"))
+    sys.modules["routers.features"] = _router_module("routers.features")
@@ -8,8 +8,9 @@ import os
 import time
 import logging
 import asyncio
-from typing import Dict, Any, Optional, List
-from fastapi import FastAPI, HTTPException, Query
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import httpx
@@ -22,6 +23,13 @@ import random
 from services.player_service import player_service
 from services.features import features_service
 from services.cache_service import cache_service
+from services.tracing import tracing_service
+from services.load_shedder import load_shedder, OverloadedError
+from services.notification_hub import notification_hub
+from services.clan_service import clan_service
+from services.meta_service import meta_service
+from services.scraper_pool import scraper_pool
+from services.page_cache import page_cache
 from routers.features import router as features_router
 
 # Настройка логирования
@@ -47,14 +55,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id"],
 )
 
-# Подключаем роутер с расширенными функциями
-app.include_router(features_router)
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Трассировка запроса и заголовок Server-Timing с длительностью этапов"""
+    trace = tracing_service.start_trace(
+        f"{request.method} {request.url.path}",
+        **{"http.method": request.method, "http.target": request.url.path}
+    )
+    try:
+        response = await call_next(request)
+    except Exception:
+        tracing_service.end_trace(trace, "ERROR")
+        raise
+    trace.root.set_attribute("http.status_code", response.status_code)
+    tracing_service.end_trace(trace, "ERROR" if response.status_code >= 500 else "OK")
+    response.headers["Server-Timing"] = trace.server_timing()
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return response
 
-# Кэш для данных (fallback)
-cache = {}
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """Быстрый отказ при перегрузке вместо очереди из зависших запросов"""
+    logger.warning(f"Shedding request to {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Service overloaded, retry in {exc.retry_after}s"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Кэш для данных (fallback), вытеснение по LRU
+cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
 CACHE_DURATION = 300  # 5 минут
+CACHE_MAX_ENTRIES = int(os.getenv("PLAYER_CACHE_MAX_ENTRIES", "10000"))
+
+# Регионы и запомненный регион игрока для region=auto
+REGIONS = ['en', 'ru', 'de', 'fr']
+AUTO_REGION = 'auto'
+REGION_MEMORY_TTL = 30 * 24 * 3600  # 30 дней
+REGION_MEMORY_MAX_ENTRIES = int(os.getenv("REGION_MEMORY_MAX_ENTRIES", "100000"))
+player_regions: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+def is_fallback(player_data: Optional[Dict[str, Any]]) -> bool:
+    """Данные не из реального источника - для лимитера это сбой апстрима"""
+    return not player_data or player_data.get("__source__") in ("fallback", "demo_data")
 
 class PlayerStats(BaseModel):
     username: str
@@ -111,30 +157,208 @@ class GameStatsAPI:
     async def get_player_stats(self, username: str, region: str = 'en') -> Dict[str, Any]:
         """Получение статистики игрока с приоритетом реальных данных"""
         try:
-            # Используем новый профессиональный сервис
-            logger.info(f"Fetching real data for player: {username} in region: {region}")
-            real_data = await player_service.get_player_stats(username, region)
-            
-            if real_data and real_data.get("__source__") != "fallback":
-                logger.info(f"Successfully retrieved real data for {username}")
+            if region == AUTO_REGION:
+                return await self._get_player_stats_auto(username)
+
+            with tracing_service.span("cache", player=username, region=region) as span:
+                cached = self._get_cached_stats(username, region)
+                span.set_attribute("hit", cached is not None)
+            if cached:
+                return cached
+
+            real_data = await self._fetch_real_stats(username, region)
+            if real_data:
+                await self._remember_region(username, region)
                 return real_data
             
-            # Если реальные данные недоступны, используем локальный Flask API
-            logger.info(f"Trying local Flask API for {username}")
-            local_data = await self._fetch_from_local_api(username, region)
-            if local_data and not local_data.get('error'):
-                transformed_data = self._transform_local_api_data(local_data)
-                if transformed_data:
-                    return transformed_data
-            
             # Fallback на демо-данные
             logger.warning(f"Using demo data for {username}")
-            return self._get_demo_stats(username)
+            with tracing_service.span("demo_fallback", player=username, source="demo_data"):
+                return self._get_demo_stats(username)
             
         except Exception as e:
             logger.error(f"Error getting player stats for {username}: {e}")
             return self._get_demo_stats(username)
 
+    async def fetch_player_stats(self, username: str, region: str = 'en') -> Optional[Dict[str, Any]]:
+        """Данные игрока для /player: только профессиональный сервис, без подмены демо-данными"""
+        if region == AUTO_REGION:
+            return await self._find_player_region(username)
+        real_data = await self._fetch_from_player_service(username, region)
+        if not is_fallback(real_data):
+            await self._remember_region(username, region)
+        return real_data
+
+    async def _fetch_from_player_service(self, username: str, region: str) -> Optional[Dict[str, Any]]:
+        """Запрос к профессиональному сервису; реальные данные кэшируются"""
+        logger.info(f"Fetching real data for player: {username} in region: {region}")
+        with tracing_service.span("real_fetch", player=username, region=region) as span:
+            real_data = await player_service.get_player_stats(username, region)
+            span.set_attribute("source", (real_data or {}).get("__source__", "none"))
+
+        if not is_fallback(real_data):
+            logger.info(f"Successfully retrieved real data for {username}")
+            self._set_cached_stats(username, region, real_data)
+            meta_service.record_player(username, region, real_data)
+        return real_data
+
+    async def _fetch_real_stats(self, username: str, region: str) -> Optional[Dict[str, Any]]:
+        """Реальные данные игрока: профессиональный сервис, затем локальный Flask API"""
+        real_data = await self._fetch_from_player_service(username, region)
+        if not is_fallback(real_data):
+            return real_data
+        
+        # Если реальные данные недоступны, используем локальный Flask API
+        logger.info(f"Trying local Flask API for {username}")
+        with tracing_service.span("local_api", player=username, region=region) as span:
+            local_data = await self._fetch_from_local_api(username, region)
+            span.set_attribute("ok", bool(local_data and not local_data.get('error')))
+        if local_data and not local_data.get('error'):
+            with tracing_service.span("transform", player=username):
+                transformed_data = self._transform_local_api_data(local_data)
+            if transformed_data:
+                self._set_cached_stats(username, region, transformed_data)
+                meta_service.record_player(username, region, transformed_data)
+                return transformed_data
+        return None
+
+    async def _get_player_stats_auto(self, username: str) -> Dict[str, Any]:
+        """Статистика игрока в любом регионе, демо-данные если игрок нигде не найден"""
+        data = await self._find_player_region(username)
+        if not is_fallback(data):
+            return data
+
+        logger.warning(f"Using demo data for {username}: not found in any region")
+        with tracing_service.span("demo_fallback", player=username, source="demo_data"):
+            return self._get_demo_stats(username)
+
+    async def _find_player_region(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        Данные игрока в его регионе; запоминается только регион возвращённого ответа.
+        Если игрок нигде не найден - ответ сервиса как есть, как и для явного региона
+        """
+        data, region = await self._search_regions(username)
+        if region is None:
+            return data
+        await self._remember_region(username, region)
+        return {**data, "__region__": region}
+
+    async def _search_regions(self, username: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Поиск игрока сразу во всех регионах через профессиональный сервис:
+        первый реальный ответ, остальные отменяются; без находки - (запасной ответ, None)
+        """
+        fallback = None
+        known_region = await self.get_known_region(username)
+        if known_region:
+            data = self._get_cached_stats(username, known_region) or \
+                await self._fetch_from_player_service(username, known_region)
+            if not is_fallback(data):
+                return data, known_region
+            fallback = data
+
+        cached = self.find_cached_region(username)
+        if cached:
+            return cached
+
+        candidates = [region for region in REGIONS if region != known_region]
+        tasks = {
+            asyncio.create_task(self._fetch_from_player_service(username, region)): region
+            for region in candidates
+        }
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    data = task.result()
+                    if not is_fallback(data):
+                        logger.info(f"Resolved region {tasks[task]} for {username}")
+                        return data, tasks[task]
+                    fallback = fallback or data
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        return fallback, None
+
+    def find_cached_region(self, username: str, allow_stale: bool = False) -> Optional[Tuple[Dict[str, Any], str]]:
+        """Данные игрока из кэша любого региона"""
+        for region in REGIONS:
+            cached = self._get_cached_stats(username, region, allow_stale)
+            if cached:
+                return cached, region
+        return None
+
+    def get_cached_player(self, username: str, region: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """Кэш для /player; для region=auto без известного региона - кэш любого региона"""
+        if region != AUTO_REGION:
+            return self._get_cached_stats(username, region, allow_stale)
+        found = self.find_cached_region(username, allow_stale)
+        return {**found[0], "__region__": found[1]} if found else None
+
+    async def get_known_region(self, username: str) -> Optional[str]:
+        """Ранее определённый регион игрока"""
+        key = username.lower()
+        entry = player_regions.get(key)
+        if entry and time.time() - entry[0] < REGION_MEMORY_TTL:
+            return entry[1]
+        try:
+            redis_client = await cache_service.get_redis()
+            if redis_client:
+                region = await redis_client.get(f"gamestats:region:{key}")
+                if region:
+                    region = region.decode() if isinstance(region, bytes) else region
+                    self._set_known_region(key, region)
+                    return region
+        except Exception as e:
+            logger.warning(f"Failed to read known region for {username}: {e}")
+        return None
+
+    async def _remember_region(self, username: str, region: str):
+        """Запоминаем регион, чтобы следующие запросы шли сразу туда"""
+        key = username.lower()
+        entry = player_regions.get(key)
+        if entry and entry[1] == region:
+            return
+        self._set_known_region(key, region)
+        try:
+            redis_client = await cache_service.get_redis()
+            if redis_client:
+                await redis_client.set(f"gamestats:region:{key}", region, ex=REGION_MEMORY_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to store known region for {username}: {e}")
+
+    @staticmethod
+    def _set_known_region(key: str, region: str):
+        player_regions[key] = (time.time(), region)
+        player_regions.move_to_end(key)
+        while len(player_regions) > REGION_MEMORY_MAX_ENTRIES:
+            player_regions.popitem(last=False)
+
+    def _get_cached_stats(self, username: str, region: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """Данные игрока из локального кэша, если они не устарели"""
+        key = f"{username}:{region}"
+        entry = cache.get(key)
+        if entry and (allow_stale or time.time() - entry[0] < CACHE_DURATION):
+            cache.move_to_end(key)
+            return entry[1]
+        return None
+
+    def _set_cached_stats(self, username: str, region: str, data: Dict[str, Any]):
+        """Сохранение данных игрока в локальный кэш"""
+        key = f"{username}:{region}"
+        cache[key] = (time.time(), data)
+        cache.move_to_end(key)
+        while len(cache) > CACHE_MAX_ENTRIES:
+            cache.popitem(last=False)
+
+    def invalidate_cached_stats(self, username: str, region: str):
+        """Сброс кэша игрока после принудительного обновления"""
+        cache.pop(f"{username}:{region}", None)
+
     async def _fetch_from_local_api(self, username: str, region: str) -> Optional[Dict[str, Any]]:
         """Получает данные от локального Flask API"""
         local_api_url = f"http://localhost:8080/profile?username={username}&region={region}"
@@ -226,10 +450,27 @@ async def startup_event():
     logger.info("🎯 Competitive: statshark.net + WT Live functionality")
     logger.info("⚡ Performance: Redis caching, Cloudflare bypass, Multiple data sources")
 
+    async def player_snapshot(key: str) -> Optional[Dict[str, Any]]:
+        region, _, username = key.partition(":")
+        return await api.get_player_stats(username, region)
+
+    async def clan_snapshot(clan_id: str) -> Optional[Dict[str, Any]]:
+        result = await clan_service.sync_clan(clan_id)
+        if not result or result["stale"]:
+            return None
+        return {"members": result["members"], "aggregates": result["aggregates"]}
+
+    notification_hub.register_source("player", player_snapshot)
+    notification_hub.register_source("clan", clan_snapshot)
+    await notification_hub.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Событие остановки приложения"""
     logger.info("🛑 Shutting down GameStats API")
+    await notification_hub.stop()
+    await scraper_pool.close()
+    await page_cache.flush()
     await api.close()
 
 @app.get("/")
@@ -301,6 +542,10 @@ async def health_check():
         return {
             "status": "healthy",
             "services": services_status,
+            "concurrency": load_shedder.stats(),
+            "notifications": notification_hub.stats(),
+            "scraper_pool": scraper_pool.stats(),
+            "page_cache": page_cache.stats(),
             "version": "3.0.0",
             "timestamp": datetime.now().isoformat(),
             "uptime": "running"
@@ -316,7 +561,7 @@ async def health_check():
 @app.get("/player/{username}")
 async def get_player_stats(
     username: str,
-    region: str = Query('en', description="Region: en, ru, de, fr")
+    region: str = Query('en', description="Region: en, ru, de, fr or auto")
 ):
     """
     Получение базовой статистики игрока
@@ -324,8 +569,30 @@ async def get_player_stats(
     try:
         logger.info(f"Getting stats for player: {username} in region: {region}")
         
-        # Используем новый профессиональный сервис
-        player_data = await player_service.get_player_stats(username, region)
+        # Для region=auto кэш ищем в запомненном регионе игрока
+        cache_region = region
+        if region == AUTO_REGION:
+            cache_region = await api.get_known_region(username) or AUTO_REGION
+        
+        # Свежий кэш отдаём без лимита, чтобы дешёвые запросы не ждали холодные
+        with tracing_service.span("cache", player=username, region=cache_region) as span:
+            player_data = api.get_cached_player(username, cache_region)
+            span.set_attribute("hit", player_data is not None)
+        if player_data is None:
+            # Поиск без известного региона опрашивает все регионы сразу и весит соответственно
+            weight = len(REGIONS) if cache_region == AUTO_REGION else 1
+            try:
+                async with load_shedder.slot("player", weight) as slot:
+                    # Используем новый профессиональный сервис
+                    player_data = await api.fetch_player_stats(username, region)
+                    if is_fallback(player_data):
+                        slot.mark_failed()
+            except OverloadedError:
+                # При перегрузке лучше устаревшие данные, чем отказ
+                stale_data = api.get_cached_player(username, cache_region, allow_stale=True)
+                if stale_data is None:
+                    raise
+                player_data = {**stale_data, "__source__": "stale_cache"}
         
         if not player_data:
             raise HTTPException(status_code=404, detail=f"Player {username} not found")
@@ -348,12 +615,13 @@ async def get_player_stats(
             "achievements": player_data.get('achievements', []),
             "performance_trends": player_data.get('performance_trends', {}),
             "source": player_data.get("__source__", "unknown"),
+            "region": player_data.get("__region__", cache_region),
             "timestamp": datetime.now().isoformat()
         }
         
         return response
         
-    except HTTPException:
+    except (HTTPException, OverloadedError):
         raise
     except Exception as e:
         logger.error(f"Error getting player stats for {username}: {e}")
@@ -368,13 +636,16 @@ async def get_top_players(
     Получение топ игроков
     """
     try:
-        top_players = await api.get_top_players(region, limit)
+        async with load_shedder.slot("top"):
+            top_players = await api.get_top_players(region, limit)
         return {
             "region": region,
             "players": top_players,
             "total": len(top_players),
             "timestamp": datetime.now().isoformat()
         }
+    except OverloadedError:
+        raise
     except Exception as e:
         logger.error(f"Error getting top players: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get top players: {e}")
@@ -390,8 +661,13 @@ async def compare_players(
     """
     try:
         # Получаем данные обоих игроков
-        player1_data = await player_service.get_player_stats(player1, region)
-        player2_data = await player_service.get_player_stats(player2, region)
+        async with load_shedder.slot("compare") as slot:
+            player1_data = await player_service.get_player_stats(player1, region)
+            player2_data = await player_service.get_player_stats(player2, region)
+            if is_fallback(player1_data) or is_fallback(player2_data):
+                slot.mark_failed()
+        meta_service.record_player(player1, region, player1_data)
+        meta_service.record_player(player2, region, player2_data)
         
         if not player1_data or not player2_data:
             raise HTTPException(status_code=404, detail="One or both players not found")
@@ -431,7 +707,7 @@ async def compare_players(
             "timestamp": datetime.now().isoformat()
         }
         
-    except HTTPException:
+    except (HTTPException, OverloadedError):
         raise
     except Exception as e:
         logger.error(f"Error comparing players {player1} vs {player2}: {e}")
@@ -443,7 +719,12 @@ async def refresh_player_stats(username: str, region: str = 'en'):
     Принудительное обновление данных игрока
     """
     try:
-        refreshed_data = await player_service.refresh_player_data(username, region)
+        async with load_shedder.slot("refresh") as slot:
+            refreshed_data = await player_service.refresh_player_data(username, region)
+            if is_fallback(refreshed_data):
+                slot.mark_failed()
+        api.invalidate_cached_stats(username, region)
+        meta_service.record_player(username, region, refreshed_data)
         
         return {
             "success": True,
@@ -453,10 +734,147 @@ async def refresh_player_stats(username: str, region: str = 'en'):
             "timestamp": datetime.now().isoformat()
         }
         
+    except OverloadedError:
+        raise
     except Exception as e:
         logger.error(f"Error refreshing player data for {username}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to refresh player data: {e}")
 
+def parse_since(since: Optional[str]) -> Optional[datetime]:
+    """ISO-время из параметра since в локальном времени журнала изменений клана"""
+    if not since:
+        return None
+    try:
+        moment = datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid since timestamp: {since}")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+async def sync_clan_or_404(clan_id: str, region: str, since: Optional[str]) -> Dict[str, Any]:
+    """Синхронизация клана под лимитом эндпоинта; устаревший ответ считается сбоем"""
+    since_time = parse_since(since)
+    async with load_shedder.slot("clan") as slot:
+        result = await clan_service.sync_clan(clan_id, region, since_time)
+        if not result or result["stale"]:
+            slot.mark_failed()
+    if not result:
+        raise HTTPException(status_code=404, detail=f"Clan {clan_id} not found")
+    return result
+
+@app.get("/api/clan")
+async def get_clan(
+    clan: str = Query(..., description="Clan (squadron) name"),
+    region: str = Query('en', description="Region: en, ru, de, fr"),
+    since: Optional[str] = Query(None, description="ISO timestamp: only changes after it (e.g. previous last_sync)")
+):
+    """
+    Состав клана и агрегированная статистика
+    """
+    try:
+        result = await sync_clan_or_404(clan, region, since)
+        return {**result, "timestamp": datetime.now().isoformat()}
+    except (HTTPException, OverloadedError):
+        raise
+    except Exception as e:
+        logger.error(f"Error getting clan {clan}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get clan: {e}")
+
+@app.get("/api/v2/clan/{clan_id}/changes")
+async def get_clan_changes(
+    clan_id: str,
+    region: str = Query('en', description="Region: en, ru, de, fr"),
+    since: Optional[str] = Query(None, description="ISO timestamp: only changes after it (e.g. previous last_sync)")
+):
+    """
+    Журнал изменений состава клана; last_sync ответа подходит как since следующего запроса
+    """
+    try:
+        result = await sync_clan_or_404(clan_id, region, since)
+        return {
+            "clan_id": clan_id,
+            "changes": result["changes"],
+            "aggregates": result["aggregates"],
+            "last_sync": result["last_sync"],
+            "stale": result["stale"],
+            "timestamp": datetime.now().isoformat()
+        }
+    except (HTTPException, OverloadedError):
+        raise
+    except Exception as e:
+        logger.error(f"Error getting clan changes for {clan_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get clan changes: {e}")
+
+@app.get("/api/v2/meta/current")
+async def get_current_meta(
+    region: Optional[str] = Query(None, description="Region: en, ru, de, fr (all regions if omitted)"),
+    window: str = Query("all", description="Window: 24h, 7d, all"),
+    limit: int = Query(20, ge=1, le=200, description="Number of vehicles to return")
+):
+    """
+    Текущая мета: самая популярная техника по собранным данным игроков
+    """
+    try:
+        meta = meta_service.get_meta(region, window, limit)
+        return {**meta, "timestamp": datetime.now().isoformat()}
+    except Exception as e:
+        logger.error(f"Error getting current meta: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get current meta: {e}")
+
+def is_valid_topic(topic: Any) -> bool:
+    """player:<region>:<nick> с известным регионом или clan:<clan_id>"""
+    if not isinstance(topic, str):
+        return False
+    kind, _, key = topic.partition(":")
+    if kind == "player":
+        region, _, nickname = key.partition(":")
+        return region in REGIONS and bool(nickname)
+    return kind == "clan" and bool(key)
+
+@app.websocket("/api/v2/ws/notifications/{nickname}")
+async def notifications_ws(websocket: WebSocket, nickname: str, region: str = 'en', clan: Optional[str] = None):
+    """
+    WebSocket уведомления об изменениях игрока и клана.
+    Клиент может подписаться на другие топики сообщением
+    {"action": "subscribe" | "unsubscribe", "topic": "player:<region>:<nick>" | "clan:<clan_id>"}
+    """
+    if region not in REGIONS:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    subscriber = notification_hub.connect(websocket)
+    notification_hub.subscribe(subscriber, f"player:{region}:{nickname}")
+    if clan:
+        notification_hub.subscribe(subscriber, f"clan:{clan}")
+
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            action = message.get("action")
+            topic = message.get("topic")
+            if not is_valid_topic(topic):
+                continue
+            if action == "subscribe":
+                if not notification_hub.subscribe(subscriber, topic):
+                    await websocket.send_json({"type": "error", "detail": "Too many subscriptions"})
+            elif action == "unsubscribe":
+                notification_hub.unsubscribe(subscriber, topic)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        notification_hub.disconnect(subscriber)
+
+# Подключаем роутер с расширенными функциями последним: Starlette выбирает первый
+# подходящий маршрут, и одноимённые эндпоинты main.py должны перекрывать роутер
+app.include_router(features_router)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
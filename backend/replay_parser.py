@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Offline replay парсера профилей War Thunder
+Прогоняет сохранённые HTML-страницы профилей через заданный парсер без сети:
+скорость (страниц/сек), время и пиковая память на страницу, диф извлечённых полей с эталоном.
+Парсер задаётся как module:attr.attr и вызывается как parser(html) или parser(html, nickname)
+
+Примеры:
+    python replay_parser.py ../wt_profile_api --parser <module>:<parser>
+    python replay_parser.py pages/ --parser <module>:<parser> --repeat 5 --save-baseline baseline.json
+    python replay_parser.py pages/ --parser <module>:<parser> --baseline baseline.json --json report.json
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+import inspect
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Any, List, Callable, Optional
+
+from services.snapshot_diff import flatten, diff
+
+CHALLENGE_MARKERS = ("Один момент", "Just a moment", "cf-challenge", "challenge-platform")
+
+
+def load_parser(path: str) -> Callable:
+    """Парсер по пути вида 'module:attr.attr'"""
+    module_name, _, attr_path = path.partition(":")
+    if not module_name or not attr_path:
+        raise SystemExit(f"Parser must be given as module:attr, got '{path}'")
+    try:
+        target: Any = importlib.import_module(module_name)
+    except ImportError as e:
+        raise SystemExit(f"Parser {path} not found: cannot import {module_name} ({e})")
+    for attr in attr_path.split("."):
+        if not hasattr(target, attr):
+            raise SystemExit(f"Parser {path} not found: {target!r} has no attribute '{attr}'")
+        target = getattr(target, attr)
+    return target
+
+
+def nickname_for(page: Path) -> str:
+    """Ник из имени файла: debug_<nick>.html или <nick>.html"""
+    stem = page.stem
+    return stem[len("debug_"):] if stem.startswith("debug_") else stem
+
+
+def takes_nickname(parser: Callable) -> bool:
+    """Ник передаётся только парсеру со вторым обязательным позиционным параметром"""
+    try:
+        params = inspect.signature(parser).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    positional = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+    required = [p for p in params if p.kind in positional and p.default is inspect.Parameter.empty]
+    return len(required) >= 2
+
+
+def run_parser(parser: Callable, html: str, nickname: str) -> Any:
+    """Вызов парсера с поддержкой (html) и (html, nickname), синхронных и async"""
+    result = parser(html, nickname) if takes_nickname(parser) else parser(html)
+    if inspect.isawaitable(result):
+        result = asyncio.run(result)
+    return result
+
+
+def replay_page(parser: Callable, page: Path, repeat: int) -> Dict[str, Any]:
+    html = page.read_text(encoding="utf-8", errors="replace")
+    nickname = nickname_for(page)
+    report: Dict[str, Any] = {
+        "page": page.name,
+        "nickname": nickname,
+        "size_kb": round(len(html.encode("utf-8")) / 1024, 1),
+        "challenge": any(marker in html[:20000] for marker in CHALLENGE_MARKERS)
+    }
+
+    # Память меряем отдельным прогоном, чтобы tracemalloc не искажал время
+    tracemalloc.start()
+    try:
+        result = run_parser(parser, html, nickname)
+        _, peak = tracemalloc.get_traced_memory()
+    except Exception as e:
+        tracemalloc.stop()
+        report["error"] = f"{type(e).__name__}: {e}"
+        return report
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run_parser(parser, html, nickname)
+        timings.append(time.perf_counter() - started)
+
+    report.update({
+        "parse_ms": round(min(timings) * 1000, 3),
+        "parse_ms_avg": round(sum(timings) / len(timings) * 1000, 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "fields": flatten(result) if isinstance(result, dict) else {},
+        "empty": not result
+    })
+    return report
+
+
+def compare_with_baseline(reports: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]):
+    for report in reports:
+        expected = baseline.get(report["page"])
+        if expected is None or "fields" not in report:
+            continue
+        report["diff"] = diff(expected, report["fields"])
+
+
+def print_summary(reports: List[Dict[str, Any]], total_seconds: float):
+    print(f"{'page':<40} {'KB':>8} {'ms':>9} {'mem KB':>9} {'fields':>7} {'diff':>5}  notes")
+    for report in reports:
+        notes = []
+        if report.get("challenge"):
+            notes.append("cloudflare challenge")
+        if report.get("empty"):
+            notes.append("empty result")
+        if report.get("error"):
+            notes.append(report["error"])
+        print(
+            f"{report['page'][:40]:<40} {report['size_kb']:>8} "
+            f"{report.get('parse_ms', '-'):>9} {report.get('peak_memory_kb', '-'):>9} "
+            f"{len(report.get('fields', {})):>7} {len(report.get('diff', [])):>5}  {', '.join(notes)}"
+        )
+        for change in report.get("diff", []):
+            print(f"    {change['field']}: {change['old']!r} -> {change['new']!r}")
+
+    parsed = [r for r in reports if "parse_ms" in r]
+    if parsed:
+        parse_seconds = sum(r["parse_ms"] for r in parsed) / 1000
+        pages_per_sec = len(parsed) / parse_seconds if parse_seconds else float("inf")
+        print(
+            f"\n{len(parsed)}/{len(reports)} pages parsed, {pages_per_sec:.1f} pages/sec "
+            f"(best-of timings), wall time {total_seconds:.2f}s"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline replay of the profile HTML parser")
+    parser.add_argument("corpus", type=Path, help="Directory with saved profile HTML pages")
+    parser.add_argument("--parser", required=True, help="Parser as module:attr.attr")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per page")
+    parser.add_argument("--baseline", type=Path, help="Extracted fields to diff against")
+    parser.add_argument("--save-baseline", type=Path, help="Write extracted fields as a new baseline")
+    parser.add_argument("--json", type=Path, help="Write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    pages = sorted(args.corpus.glob("*.html"))
+    if not pages:
+        print(f"No HTML pages in {args.corpus}", file=sys.stderr)
+        return 1
+
+    parse = load_parser(args.parser)
+    started = time.perf_counter()
+    reports = [replay_page(parse, page, max(1, args.repeat)) for page in pages]
+    total_seconds = time.perf_counter() - started
+
+    if args.baseline:
+        compare_with_baseline(reports, json.loads(args.baseline.read_text(encoding="utf-8")))
+
+    print_summary(reports, total_seconds)
+
+    if args.save_baseline:
+        baseline = {r["page"]: r["fields"] for r in reports if "fields" in r}
+        args.save_baseline.write_text(json.dumps(baseline, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+    if args.json:
+        args.json.write_text(json.dumps(reports, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+
+    has_errors = any(r.get("error") or r.get("diff") for r in reports)
+    return 1 if has_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
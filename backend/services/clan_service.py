@@ -0,0 +1,273 @@
+"""
+Clan Service - синхронизация состава клана
+Состав загружается одной страницей, сравнивается с предыдущим по никам,
+и обновляются только изменившиеся участники; агрегаты клана пересчитываются инкрементально
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+
+from bs4 import BeautifulSoup
+
+from services.player_service import player_service
+from services.cache_service import cache_service
+from services.page_cache import page_cache
+from services.meta_service import meta_service
+
+logger = logging.getLogger(__name__)
+
+WT_BASE_URL = os.getenv("WT_API_BASE_URL", "https://warthunder.com")
+REFRESH_CONCURRENCY = int(os.getenv("CLAN_REFRESH_CONCURRENCY", "5"))
+# Большой новый клан дозагружается за несколько синхронизаций, а не одним залпом запросов
+MAX_REFRESHES_PER_SYNC = int(os.getenv("CLAN_MAX_REFRESHES_PER_SYNC", "20"))
+CHANGE_LOG_SIZE = int(os.getenv("CLAN_CHANGE_LOG_SIZE", "200"))
+# Участник, чей профиль не удалось загрузить (обычно Cloudflare), не дозагружается до истечения паузы
+REFRESH_RETRY_AFTER = int(os.getenv("CLAN_REFRESH_RETRY_AFTER", "900"))  # 15 минут
+CLAN_STATE_TTL = int(os.getenv("CLAN_STATE_TTL", "604800"))  # 7 дней
+
+ROSTER_COLUMNS = 6  # №, игрок, рейтинг, активность, роль, дата вступления
+ROSTER_FIELDS = ("clan_rating", "activity", "role", "joined")
+STAT_FIELDS = ("battles", "wins", "kills", "deaths")
+
+
+def _to_int(value: str) -> int:
+    digits = "".join(ch for ch in value if ch.isdigit())
+    return int(digits) if digits else 0
+
+
+def _empty_aggregates() -> Dict[str, Any]:
+    return {
+        "members": 0,
+        "clan_rating": 0,
+        "activity": 0,
+        "roles": {},
+        "tracked_members": 0,
+        **{field: 0 for field in STAT_FIELDS}
+    }
+
+
+def diff_roster(old_roster: Dict[str, Dict[str, Any]],
+                new_roster: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Кто вступил, вышел и у кого поменялись данные в составе"""
+    old_members = old_roster.keys()
+    new_members = new_roster.keys()
+    return {
+        "joined": sorted(new_members - old_members),
+        "left": sorted(old_members - new_members),
+        "changed": sorted(
+            nick for nick in new_members & old_members
+            if any(new_roster[nick].get(f) != old_roster[nick].get(f) for f in ROSTER_FIELDS)
+        )
+    }
+
+
+def changes_since(change_log: List[Dict[str, Any]], since: Optional[datetime]) -> List[Dict[str, Any]]:
+    """Записи журнала изменений новее since (весь журнал, если since не задан)"""
+    if since is None:
+        return list(change_log)
+    return [entry for entry in change_log if datetime.fromisoformat(entry["timestamp"]) > since]
+
+
+class ClanService:
+    def __init__(self):
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def fetch_roster(self, clan_id: str, region: str = 'en') -> Optional[Dict[str, Dict[str, Any]]]:
+        """Один запрос за страницей клана, состав по никам"""
+        url = f"{WT_BASE_URL}/{region}/community/claninfo/{clan_id}"
+        try:
+            # Неизменившаяся страница не разбирается повторно
+            return await page_cache.get_parsed(f"clan:{region}:{clan_id}", url, self.parse_roster, "roster_v1")
+        except Exception as e:
+            logger.error(f"Clan roster request failed for {clan_id}: {e}")
+            return None
+
+    def parse_roster(self, html: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Разбор таблицы участников со страницы клана"""
+        soup = BeautifulSoup(html, "lxml")
+        cells = soup.select("div.squadrons-members__grid-item")
+        if not cells:
+            return None
+
+        roster = {}
+        for i in range(0, len(cells) - ROSTER_COLUMNS + 1, ROSTER_COLUMNS):
+            row = cells[i:i + ROSTER_COLUMNS]
+            # Первая строка сетки - заголовки
+            if not row[0].get_text(strip=True).isdigit():
+                continue
+            link = row[1].find("a")
+            nick = (link or row[1]).get_text(strip=True)
+            if not nick:
+                continue
+            roster[nick] = {
+                "clan_rating": _to_int(row[2].get_text()),
+                "activity": _to_int(row[3].get_text()),
+                "role": row[4].get_text(strip=True),
+                "joined": row[5].get_text(strip=True)
+            }
+        return roster
+
+    async def _load_state(self, key: str) -> Dict[str, Any]:
+        """Состояние клана из Redis (общее для воркеров) или из памяти"""
+        state = None
+        try:
+            redis_client = await cache_service.get_redis()
+            if redis_client:
+                raw = await redis_client.get(f"gamestats:clan:{key}")
+                state = json.loads(raw) if raw else None
+        except Exception as e:
+            logger.warning(f"Failed to load clan state {key}: {e}")
+        state = state or self.states.get(key) or {
+            "roster": {}, "member_stats": {}, "aggregates": _empty_aggregates()
+        }
+        state.setdefault("change_log", [])
+        state.setdefault("refresh_failures", {})
+        self.states[key] = state
+        return state
+
+    async def _store_state(self, key: str, state: Dict[str, Any]):
+        self.states[key] = state
+        try:
+            redis_client = await cache_service.get_redis()
+            if redis_client:
+                await redis_client.set(f"gamestats:clan:{key}", json.dumps(state), ex=CLAN_STATE_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to store clan state {key}: {e}")
+
+    @staticmethod
+    def _apply_member(aggregates: Dict[str, Any], member: Dict[str, Any], sign: int):
+        aggregates["members"] += sign
+        aggregates["clan_rating"] += sign * member.get("clan_rating", 0)
+        aggregates["activity"] += sign * member.get("activity", 0)
+        roles = aggregates["roles"]
+        role = member.get("role") or "unknown"
+        roles[role] = roles.get(role, 0) + sign
+        if roles[role] <= 0:
+            del roles[role]
+
+    @staticmethod
+    def _apply_stats(aggregates: Dict[str, Any], stats: Dict[str, Any], sign: int):
+        aggregates["tracked_members"] += sign
+        for field in STAT_FIELDS:
+            aggregates[field] += sign * stats.get(field, 0)
+
+    async def _fetch_member_stats(self, nick: str, region: str) -> Optional[Dict[str, Any]]:
+        try:
+            data = await player_service.refresh_player_data(nick, region)
+        except Exception as e:
+            logger.warning(f"Failed to refresh clan member {nick}: {e}")
+            return None
+        if not data or data.get("__source__") in ("demo_data", "fallback"):
+            return None
+        meta_service.record_player(nick, region, data)
+        general = data.get("general", {})
+        return {
+            "battles": general.get("total_battles", 0),
+            "wins": general.get("wins", 0),
+            "kills": general.get("kills", 0),
+            "deaths": general.get("deaths", 0)
+        }
+
+    async def sync_clan(self, clan_id: str, region: str = 'en',
+                        since: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """
+        Синхронизация клана: диф состава и обновление только изменившихся участников.
+        Изменения копятся в журнале состояния, since выбирает записи новее этого момента
+        """
+        key = f"{region}:{clan_id}"
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            state = await self._load_state(key)
+            roster = await self.fetch_roster(clan_id, region)
+            if roster is None:
+                if not state["roster"]:
+                    return None
+                return self._build_result(clan_id, state, since, stale=True)
+
+            old_roster = state["roster"]
+            aggregates = state["aggregates"]
+            member_stats = state["member_stats"]
+            failures = state["refresh_failures"]
+            changes = diff_roster(old_roster, roster)
+
+            for nick in changes["left"]:
+                failures.pop(nick, None)
+                self._apply_member(aggregates, old_roster[nick], -1)
+                if nick in member_stats:
+                    self._apply_stats(aggregates, member_stats.pop(nick), -1)
+            for nick in changes["changed"]:
+                self._apply_member(aggregates, old_roster[nick], -1)
+                self._apply_member(aggregates, roster[nick], 1)
+            for nick in changes["joined"]:
+                self._apply_member(aggregates, roster[nick], 1)
+
+            # Новые данные профиля нужны только тем, у кого что-то поменялось в составе;
+            # участники без статистики (новые сверх лимита или с неудачным обновлением)
+            # дозагружаются в следующих синхронизациях, недавние неудачи - после паузы
+            queued = set(changes["joined"]) | set(changes["changed"])
+            retry_before = time.time() - REFRESH_RETRY_AFTER
+            missing = sorted(
+                nick for nick in roster
+                if nick not in member_stats and nick not in queued and failures.get(nick, 0) <= retry_before
+            )
+            to_refresh = (changes["joined"] + changes["changed"] + missing)[:MAX_REFRESHES_PER_SYNC]
+            semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+            async def refresh(nick: str):
+                async with semaphore:
+                    return nick, await self._fetch_member_stats(nick, region)
+
+            for nick, stats in await asyncio.gather(*(refresh(nick) for nick in to_refresh)):
+                if stats is None:
+                    failures[nick] = time.time()
+                    continue
+                failures.pop(nick, None)
+                if nick in member_stats:
+                    self._apply_stats(aggregates, member_stats[nick], -1)
+                member_stats[nick] = stats
+                self._apply_stats(aggregates, stats, 1)
+
+            now = datetime.now().isoformat()
+            state["roster"] = roster
+            state["last_sync"] = now
+            # Первая синхронизация - это исходный состав, а не изменения
+            if old_roster and any(changes.values()):
+                state["change_log"] = (state["change_log"] + [{"timestamp": now, **changes}])[-CHANGE_LOG_SIZE:]
+            await self._store_state(key, state)
+
+            logger.info(
+                f"Clan {clan_id} synced: {len(changes['joined'])} joined, {len(changes['left'])} left, "
+                f"{len(changes['changed'])} changed, {len(to_refresh)} member refreshes"
+            )
+            return self._build_result(clan_id, state, since)
+
+    def _build_result(self, clan_id: str, state: Dict[str, Any], since: Optional[datetime] = None,
+                      stale: bool = False) -> Dict[str, Any]:
+        aggregates = state["aggregates"]
+        members = aggregates["members"] or 1
+        tracked = aggregates["tracked_members"] or 1
+        return {
+            "clan_id": clan_id,
+            "members": state["roster"],
+            "changes": changes_since(state["change_log"], since),
+            "aggregates": {
+                **aggregates,
+                "avg_clan_rating": round(aggregates["clan_rating"] / members, 1),
+                "avg_activity": round(aggregates["activity"] / members, 1),
+                "win_rate": round(aggregates["wins"] / aggregates["battles"], 3) if aggregates["battles"] else 0.0,
+                "kdr": round(aggregates["kills"] / max(aggregates["deaths"], 1), 2),
+                "avg_battles": round(aggregates["battles"] / tracked, 1)
+            },
+            "last_sync": state.get("last_sync"),
+            "stale": stale
+        }
+
+
+# Глобальный экземпляр сервиса кланов
+clan_service = ClanService()
@@ -0,0 +1,138 @@
+"""
+Load Shedder - адаптивное ограничение параллельных запросов
+AIMD-лимиты на каждый эндпоинт по наблюдаемой задержке
+"""
+
+import os
+import math
+import time
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+INITIAL_LIMIT = float(os.getenv("LOAD_SHED_INITIAL_LIMIT", "20"))
+MIN_LIMIT = float(os.getenv("LOAD_SHED_MIN_LIMIT", "2"))
+MAX_LIMIT = float(os.getenv("LOAD_SHED_MAX_LIMIT", "200"))
+BACKOFF_RATIO = float(os.getenv("LOAD_SHED_BACKOFF_RATIO", "0.9"))
+DEFAULT_TARGET_LATENCY = float(os.getenv("LOAD_SHED_TARGET_LATENCY", "5.0"))
+
+
+class OverloadedError(Exception):
+    """Лимит параллельных запросов исчерпан"""
+
+    def __init__(self, route: str, retry_after: int):
+        super().__init__(f"Route {route} is overloaded")
+        self.route = route
+        self.retry_after = retry_after
+
+
+class Slot:
+    """Занятый слот одного запроса; ответ из запасного источника помечается как сбой"""
+
+    __slots__ = ("limiter", "weight", "failed")
+
+    def __init__(self, limiter: "AdaptiveLimiter", weight: int = 1):
+        self.limiter = limiter
+        self.weight = weight
+        self.failed = False
+
+    def mark_failed(self):
+        self.failed = True
+
+
+class AdaptiveLimiter:
+    """Лимит параллельности с аддитивным ростом и мультипликативным снижением"""
+
+    def __init__(self, route: str, target_latency: float = DEFAULT_TARGET_LATENCY):
+        self.route = route
+        self.target_latency = target_latency
+        self.limit = INITIAL_LIMIT
+        self.in_flight = 0
+        self.avg_latency = 0.0
+        self.last_decrease = 0.0
+        self.accepted = 0
+        self.rejected = 0
+
+    def try_acquire(self, weight: int = 1) -> bool:
+        """Запрос с весом weight занимает столько же единиц лимита, сколько запросов к апстриму делает"""
+        # Тяжёлый запрос при пустом эндпоинте проходит, даже если его вес больше лимита
+        if self.in_flight and self.in_flight + weight > int(self.limit):
+            self.rejected += 1
+            return False
+        self.in_flight += weight
+        self.accepted += 1
+        return True
+
+    def release(self, latency: float, success: bool = True, weight: int = 1):
+        self.in_flight -= weight
+        self.avg_latency = latency if not self.avg_latency else 0.8 * self.avg_latency + 0.2 * latency
+
+        now = time.monotonic()
+        if not success or latency > self.target_latency:
+            # Снижаем не чаще раза за целевую задержку, чтобы пачка медленных
+            # ответов из одного окна не обрушила лимит до минимума
+            if now - self.last_decrease >= self.target_latency:
+                self.limit = max(MIN_LIMIT, self.limit * BACKOFF_RATIO)
+                self.last_decrease = now
+                logger.info(f"Concurrency limit for {self.route} decreased to {self.limit:.1f}")
+        else:
+            self.limit = min(MAX_LIMIT, self.limit + weight / self.limit)
+
+    def retry_after(self) -> int:
+        """Оценка в секундах, когда стоит повторить запрос"""
+        return max(1, math.ceil(self.avg_latency or self.target_latency))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "avg_latency_ms": round(self.avg_latency * 1000, 1),
+            "target_latency_ms": round(self.target_latency * 1000, 1),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        }
+
+
+class LoadShedder:
+    def __init__(self):
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+        # Целевые задержки для эндпоинтов; холодные запросы к WT медленные
+        self.target_latencies = {
+            "player": float(os.getenv("LOAD_SHED_PLAYER_LATENCY", "8.0")),
+            "compare": float(os.getenv("LOAD_SHED_COMPARE_LATENCY", "12.0")),
+            "refresh": float(os.getenv("LOAD_SHED_REFRESH_LATENCY", "8.0")),
+            "top": float(os.getenv("LOAD_SHED_TOP_LATENCY", "1.0")),
+            "clan": float(os.getenv("LOAD_SHED_CLAN_LATENCY", "15.0")),
+        }
+
+    def get_limiter(self, route: str) -> AdaptiveLimiter:
+        if route not in self.limiters:
+            target = self.target_latencies.get(route, DEFAULT_TARGET_LATENCY)
+            self.limiters[route] = AdaptiveLimiter(route, target)
+        return self.limiters[route]
+
+    @asynccontextmanager
+    async def slot(self, route: str, weight: int = 1) -> AsyncIterator[Slot]:
+        """Занимает слот эндпоинта (weight единиц лимита) или сразу выбрасывает OverloadedError"""
+        limiter = self.get_limiter(route)
+        if not limiter.try_acquire(weight):
+            raise OverloadedError(route, limiter.retry_after())
+
+        slot = Slot(limiter, weight)
+        started = time.monotonic()
+        try:
+            yield slot
+        except BaseException:
+            slot.mark_failed()
+            raise
+        finally:
+            limiter.release(time.monotonic() - started, not slot.failed, weight)
+
+    def stats(self) -> Dict[str, Any]:
+        return {route: limiter.stats() for route, limiter in self.limiters.items()}
+
+
+# Глобальный экземпляр ограничителя нагрузки
+load_shedder = LoadShedder()
@@ -0,0 +1,253 @@
+"""
+Meta Service - агрегаты по технике из собранных данных игроков
+Счётчики по технике ведутся инкрементально по регионам и часовым окнам,
+распределения винрейта и K/D хранятся в объединяемых скетчах
+"""
+
+import os
+import math
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SECONDS = 3600
+WINDOWS = {"24h": 24, "7d": 24 * 7}
+MAX_TRACKED_PLAYERS = int(os.getenv("META_MAX_PLAYERS", "100000"))
+SKETCH_ACCURACY = float(os.getenv("META_SKETCH_ACCURACY", "0.01"))
+COUNTER_FIELDS = ("battles", "wins", "kills", "deaths")
+
+
+class QuantileSketch:
+    """Логарифмический скетч квантилей (в духе DDSketch): объединяемый и с удалением"""
+
+    __slots__ = ("gamma", "log_gamma", "bins", "zero_count", "count")
+
+    def __init__(self, relative_accuracy: float = SKETCH_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float, weight: int = 1):
+        self.count += weight
+        if value <= 0:
+            self.zero_count += weight
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + weight
+        if self.bins[index] <= 0:
+            del self.bins[index]
+
+    def remove(self, value: float):
+        self.add(value, -1)
+
+    def merge(self, other: "QuantileSketch"):
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, weight in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + weight
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1) if self.bins else 0.0
+
+
+class VehicleAggregate:
+    """Счётчики и распределения одной техники в одном регионе"""
+
+    __slots__ = ("counters", "players", "win_rate", "kdr")
+
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTER_FIELDS, 0)
+        self.players = 0
+        self.win_rate = QuantileSketch()
+        self.kdr = QuantileSketch()
+
+    def apply(self, stats: Dict[str, int], sign: int):
+        for field in COUNTER_FIELDS:
+            self.counters[field] += sign * stats.get(field, 0)
+        self.players += sign
+        if stats.get("battles"):
+            win_rate = stats.get("wins", 0) / stats["battles"]
+            kdr = stats.get("kills", 0) / max(stats.get("deaths", 0), 1)
+            self.win_rate.add(win_rate, sign)
+            self.kdr.add(kdr, sign)
+
+    def merge(self, other: "VehicleAggregate"):
+        for field in COUNTER_FIELDS:
+            self.counters[field] += other.counters[field]
+        self.players += other.players
+        self.win_rate.merge(other.win_rate)
+        self.kdr.merge(other.kdr)
+
+
+def _vehicle_stats(vehicle: Dict[str, Any]) -> Dict[str, int]:
+    return {field: int(vehicle.get(field) or 0) for field in COUNTER_FIELDS}
+
+
+def extract_vehicles(player_data: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """Статистика техники из данных игрока в любом из форматов источников"""
+    vehicles = {}
+    for vehicle in player_data.get("top_vehicles") or []:
+        if isinstance(vehicle, dict) and vehicle.get("name"):
+            vehicles[vehicle["name"]] = _vehicle_stats(vehicle)
+    top_vehicle = (player_data.get("vehicles") or {}).get("top_vehicle")
+    if isinstance(top_vehicle, dict) and top_vehicle.get("name") and top_vehicle["name"] not in vehicles:
+        vehicles[top_vehicle["name"]] = _vehicle_stats(top_vehicle)
+    return vehicles
+
+
+class MetaService:
+    def __init__(self):
+        # Накопленная статистика отслеживаемых игроков: регион -> техника -> агрегат
+        self.all_time: Dict[str, Dict[str, VehicleAggregate]] = {}
+        # Приросты за часовые бакеты: регион -> час -> техника -> счётчики
+        self.buckets: Dict[str, Dict[int, Dict[str, Dict[str, int]]]] = {}
+        # Последний снимок техники игрока, чтобы учитывать только приросты
+        self.player_vehicles: "OrderedDict[Tuple[str, str], Dict[str, Dict[str, int]]]" = OrderedDict()
+        self.version = 0
+        self._snapshots: Dict[Tuple[str, str, int, int], Tuple[int, Dict[str, Any]]] = {}
+
+    def record_player(self, username: str, region: str, player_data: Dict[str, Any]):
+        """Учёт техники игрока после получения реальных данных"""
+        if not player_data or player_data.get("__source__") in ("demo_data", "fallback"):
+            return
+        vehicles = extract_vehicles(player_data)
+        if not vehicles:
+            return
+
+        key = (region, username.lower())
+        previous = self.player_vehicles.pop(key, {})
+        self.player_vehicles[key] = vehicles
+        region_all_time = self.all_time.setdefault(region, {})
+        hour = int(time.time() // BUCKET_SECONDS)
+        bucket = self.buckets.setdefault(region, {}).setdefault(hour, {})
+
+        for name, stats in vehicles.items():
+            aggregate = region_all_time.setdefault(name, VehicleAggregate())
+            old_stats = previous.get(name)
+            if old_stats is not None:
+                if old_stats == stats:
+                    continue
+                aggregate.apply(old_stats, -1)
+                # В окна идёт только прирост, сыгранный с прошлого снимка
+                delta = {field: stats[field] - old_stats[field] for field in COUNTER_FIELDS}
+                if all(value >= 0 for value in delta.values()):
+                    counters = bucket.setdefault(name, dict.fromkeys(COUNTER_FIELDS, 0))
+                    for field in COUNTER_FIELDS:
+                        counters[field] += delta[field]
+            aggregate.apply(stats, 1)
+
+        # Техника, выпавшая из топа игрока, больше не учитывается в его вкладе
+        for name in previous.keys() - vehicles.keys():
+            if name in region_all_time:
+                region_all_time[name].apply(previous[name], -1)
+
+        self.version += 1
+        self._evict(region)
+
+    def _evict(self, region: str):
+        """Ограничение памяти: старые бакеты и давно не виденные игроки"""
+        oldest_hour = int(time.time() // BUCKET_SECONDS) - max(WINDOWS.values())
+        region_buckets = self.buckets.get(region, {})
+        for hour in [h for h in region_buckets if h <= oldest_hour]:
+            del region_buckets[hour]
+
+        while len(self.player_vehicles) > MAX_TRACKED_PLAYERS:
+            (old_region, _), vehicles = self.player_vehicles.popitem(last=False)
+            region_all_time = self.all_time.get(old_region, {})
+            for name, stats in vehicles.items():
+                if name in region_all_time:
+                    region_all_time[name].apply(stats, -1)
+
+    def _all_time_for(self, region: Optional[str]) -> Dict[str, VehicleAggregate]:
+        if region:
+            return self.all_time.get(region, {})
+        merged: Dict[str, VehicleAggregate] = {}
+        for region_aggregates in self.all_time.values():
+            for name, aggregate in region_aggregates.items():
+                merged.setdefault(name, VehicleAggregate()).merge(aggregate)
+        return merged
+
+    def _window_for(self, region: Optional[str], hours: int) -> Dict[str, Dict[str, int]]:
+        since = int(time.time() // BUCKET_SECONDS) - hours
+        totals: Dict[str, Dict[str, int]] = {}
+        regions = [region] if region else list(self.buckets.keys())
+        for name_region in regions:
+            for hour, bucket in self.buckets.get(name_region, {}).items():
+                if hour <= since:
+                    continue
+                for name, counters in bucket.items():
+                    vehicle_totals = totals.setdefault(name, dict.fromkeys(COUNTER_FIELDS, 0))
+                    for field in COUNTER_FIELDS:
+                        vehicle_totals[field] += counters[field]
+        return totals
+
+    @staticmethod
+    def _rates(counters: Dict[str, int]) -> Dict[str, Any]:
+        battles = counters["battles"]
+        return {
+            **counters,
+            "win_rate": round(counters["wins"] / battles, 3) if battles else 0.0,
+            "kdr": round(counters["kills"] / max(counters["deaths"], 1), 2)
+        }
+
+    def get_meta(self, region: Optional[str] = None, window: str = "all", limit: int = 20) -> Dict[str, Any]:
+        """Текущая мета по технике из предрасчитанных агрегатов"""
+        cache_key = (region or "all", window, limit, int(time.time() // BUCKET_SECONDS))
+        cached = self._snapshots.get(cache_key)
+        if cached and cached[0] == self.version:
+            return cached[1]
+
+        vehicles = []
+        if window in WINDOWS:
+            for name, counters in self._window_for(region, WINDOWS[window]).items():
+                if counters["battles"] > 0:
+                    vehicles.append({"name": name, **self._rates(counters)})
+        else:
+            for name, aggregate in self._all_time_for(region).items():
+                if aggregate.players <= 0 or aggregate.counters["battles"] <= 0:
+                    continue
+                vehicles.append({
+                    "name": name,
+                    "players": aggregate.players,
+                    **self._rates(aggregate.counters),
+                    "win_rate_percentiles": {
+                        f"p{int(q * 100)}": round(aggregate.win_rate.quantile(q) or 0.0, 3)
+                        for q in (0.25, 0.5, 0.75, 0.9)
+                    },
+                    "kdr_percentiles": {
+                        f"p{int(q * 100)}": round(aggregate.kdr.quantile(q) or 0.0, 2)
+                        for q in (0.25, 0.5, 0.75, 0.9)
+                    }
+                })
+
+        vehicles.sort(key=lambda v: v["battles"], reverse=True)
+        result = {
+            "region": region or "all",
+            "window": window if window in WINDOWS else "all",
+            "vehicles": vehicles[:limit],
+            "total_vehicles": len(vehicles),
+            "tracked_players": len(self.player_vehicles)
+        }
+        # Снимки прошлых часов больше не понадобятся
+        self._snapshots = {k: v for k, v in self._snapshots.items() if k[3] == cache_key[3]}
+        self._snapshots[cache_key] = (self.version, result)
+        return result
+
+
+# Глобальный экземпляр сервиса меты
+meta_service = MetaService()
@@ -0,0 +1,279 @@
+"""
+Notification Hub - рассылка изменений игроков и кланов по WebSocket
+Изменения определяются один раз сравнением снимков и раздаются всем подписчикам,
+между воркерами события передаются через Redis pub/sub
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Set, Callable, Awaitable
+
+from services.cache_service import cache_service
+from services.snapshot_diff import flatten, diff
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = int(os.getenv("NOTIFY_POLL_INTERVAL", "60"))
+QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "100"))
+SEND_TIMEOUT = float(os.getenv("NOTIFY_SEND_TIMEOUT", "5.0"))
+MAX_CONCURRENT_FETCHES = int(os.getenv("NOTIFY_MAX_CONCURRENT_FETCHES", "10"))
+MAX_TOPICS_PER_CONNECTION = int(os.getenv("NOTIFY_MAX_TOPICS_PER_CONNECTION", "10"))
+LISTENER_BACKOFF_MIN = 1.0
+LISTENER_BACKOFF_MAX = 60.0
+REDIS_CHANNEL = "gamestats:notifications"
+
+# Поля, изменение которых не является событием
+IGNORED_FIELDS = {"timestamp", "last_updated", "cached_at"}
+
+SnapshotSource = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+
+def _is_event_field(path: str) -> bool:
+    return not any(part.startswith("__") or part in IGNORED_FIELDS for part in path.split("."))
+
+
+def flatten_snapshot(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Плоский снимок без служебных полей и меток времени"""
+    return {path: value for path, value in flatten(data).items() if _is_event_field(path)}
+
+
+class Subscriber:
+    """WebSocket-подписчик с ограниченной очередью исходящих сообщений"""
+
+    __slots__ = ("websocket", "topics", "queue", "sender", "dropped", "closed")
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.topics: Set[str] = set()
+        # При переполнении старые сообщения вытесняются новыми
+        self.queue: deque = deque(maxlen=QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+
+    def push(self, message: str):
+        if self.closed:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(message)
+        # Задача отправки живёт только пока есть что отправлять,
+        # простаивающее соединение не держит лишних корутин
+        if self.sender is None or self.sender.done():
+            self.sender = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self.queue and not self.closed:
+            message = self.queue.popleft()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(message), SEND_TIMEOUT)
+            except Exception as e:
+                logger.info(f"Dropping slow or closed WebSocket subscriber: {e}")
+                self.closed = True
+                self.queue.clear()
+                try:
+                    await self.websocket.close()
+                except Exception:
+                    pass
+
+
+class NotificationHub:
+    def __init__(self):
+        self.topics: Dict[str, Set[Subscriber]] = {}
+        self.sources: Dict[str, SnapshotSource] = {}
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+        self.worker_id = f"{os.getpid()}-{int(time.time())}"
+        self._tasks: List[asyncio.Task] = []
+        self._redis = None
+
+    def register_source(self, kind: str, source: SnapshotSource):
+        """Источник снимков для топиков вида '<kind>:<key>'"""
+        self.sources[kind] = source
+
+    def connect(self, websocket) -> Subscriber:
+        return Subscriber(websocket)
+
+    def subscribe(self, subscriber: Subscriber, topic: str) -> bool:
+        """Подписка; каждый топик - это опрос апстрима, поэтому их число ограничено"""
+        if topic not in subscriber.topics and len(subscriber.topics) >= MAX_TOPICS_PER_CONNECTION:
+            return False
+        subscriber.topics.add(topic)
+        self.topics.setdefault(topic, set()).add(subscriber)
+        return True
+
+    def unsubscribe(self, subscriber: Subscriber, topic: str):
+        subscriber.topics.discard(topic)
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.topics[topic]
+                self.snapshots.pop(topic, None)
+
+    def disconnect(self, subscriber: Subscriber):
+        subscriber.closed = True
+        for topic in list(subscriber.topics):
+            self.unsubscribe(subscriber, topic)
+        if subscriber.sender and not subscriber.sender.done():
+            subscriber.sender.cancel()
+
+    def _fan_out(self, topic: str, message: str):
+        for subscriber in list(self.topics.get(topic, ())):
+            subscriber.push(message)
+
+    async def publish(self, topic: str, event: Dict[str, Any]):
+        """Публикация события: через Redis всем воркерам или локально"""
+        message = json.dumps({"topic": topic, **event}, default=str)
+        if self._redis:
+            try:
+                await self._redis.publish(REDIS_CHANNEL, message)
+                return
+            except Exception as e:
+                logger.warning(f"Redis publish failed, delivering locally: {e}")
+        self._fan_out(topic, message)
+
+    async def start(self):
+        """Запуск детектора изменений и слушателя Redis"""
+        try:
+            self._redis = await cache_service.get_redis()
+        except Exception as e:
+            logger.warning(f"Redis unavailable for notifications, running single-worker: {e}")
+            self._redis = None
+
+        self._tasks.append(asyncio.create_task(self._monitor_loop()))
+        if self._redis:
+            self._tasks.append(asyncio.create_task(self._redis_listener()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
+    async def _redis_listener(self):
+        """Раздача событий, опубликованных любым воркером; переподключение с backoff"""
+        backoff = LISTENER_BACKOFF_MIN
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(REDIS_CHANNEL)
+                backoff = LISTENER_BACKOFF_MIN
+                async for item in pubsub.listen():
+                    if item.get("type") == "message":
+                        self._deliver_remote(item["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification Redis listener failed, reconnecting in {backoff}s: {e}")
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, LISTENER_BACKOFF_MAX)
+
+    def _deliver_remote(self, message):
+        """Одно сообщение из Redis; битое сообщение не останавливает слушателя"""
+        try:
+            if isinstance(message, bytes):
+                message = message.decode()
+            topic = json.loads(message).get("topic")
+        except Exception as e:
+            logger.warning(f"Skipping malformed notification message: {e}")
+            return
+        if topic in self.topics:
+            self._fan_out(topic, message)
+
+    async def _monitor_loop(self):
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+        async def check(topic: str):
+            async with semaphore:
+                await self._check_topic(topic)
+
+        while True:
+            try:
+                topics = list(self.topics.keys())
+                if topics:
+                    await asyncio.gather(*(check(topic) for topic in topics))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification monitor cycle failed: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def _claim_topic(self, topic: str) -> bool:
+        """Только один воркер за цикл опрашивает топик"""
+        if not self._redis:
+            return True
+        try:
+            return bool(await self._redis.set(
+                f"gamestats:notify:lock:{topic}", self.worker_id, nx=True, ex=max(1, POLL_INTERVAL - 1)
+            ))
+        except Exception:
+            return True
+
+    async def _load_snapshot(self, topic: str) -> Optional[Dict[str, Any]]:
+        if self._redis:
+            try:
+                raw = await self._redis.get(f"gamestats:notify:snapshot:{topic}")
+                return json.loads(raw) if raw else None
+            except Exception:
+                pass
+        return self.snapshots.get(topic)
+
+    async def _store_snapshot(self, topic: str, snapshot: Dict[str, Any]):
+        self.snapshots[topic] = snapshot
+        if self._redis:
+            try:
+                await self._redis.set(
+                    f"gamestats:notify:snapshot:{topic}", json.dumps(snapshot, default=str),
+                    ex=POLL_INTERVAL * 10
+                )
+            except Exception:
+                pass
+
+    async def _check_topic(self, topic: str):
+        kind, _, key = topic.partition(":")
+        source = self.sources.get(kind)
+        if source is None or not await self._claim_topic(topic):
+            return
+
+        data = await source(key)
+        # Демо-данные случайны, сравнивать их бессмысленно
+        if not data or data.get("__source__") in ("demo_data", "fallback"):
+            return
+
+        snapshot = flatten_snapshot(data)
+        previous = await self._load_snapshot(topic)
+        await self._store_snapshot(topic, snapshot)
+        if previous is None:
+            return
+
+        changes = diff(previous, snapshot)
+        if changes:
+            await self.publish(topic, {
+                "type": "change",
+                "changes": changes,
+                "timestamp": datetime.now().isoformat()
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        subscribers = set()
+        for topic_subscribers in self.topics.values():
+            subscribers.update(topic_subscribers)
+        return {
+            "topics": len(self.topics),
+            "connections": len(subscribers),
+            "dropped_messages": sum(s.dropped for s in subscribers),
+            "redis": self._redis is not None
+        }
+
+
+# Глобальный экземпляр хаба уведомлений
+notification_hub = NotificationHub()
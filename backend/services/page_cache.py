@@ -0,0 +1,283 @@
+"""
+Page Cache - дисковый кэш сырых HTML-страниц с адресацией по содержимому
+Неизменившиеся страницы (304 или тот же хэш) не разбираются повторно,
+объём ограничен с вытеснением по LRU; диск и разбор работают вне event loop
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, List, Tuple
+
+from services.scraper_pool import scraper_pool
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_DIR = Path(os.getenv("PAGE_CACHE_DIR", ".cache/pages"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_MB", "512")) * 1024 * 1024
+# Как часто сохранять индекс, если менялся только порядок LRU и время проверки
+INDEX_SAVE_INTERVAL = float(os.getenv("PAGE_CACHE_INDEX_SAVE_INTERVAL", "60"))
+
+
+def _atomic_write(path: Path, data: bytes):
+    # Уникальное имя временного файла: параллельные записи не мешают друг другу
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False) as tmp:
+        tmp.write(data)
+    try:
+        os.replace(tmp.name, path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+
+def _digest(text: str) -> Tuple[bytes, str]:
+    body = text.encode("utf-8")
+    return body, hashlib.sha256(body).hexdigest()
+
+
+class PageCache:
+    def __init__(self, root: Path = PAGE_CACHE_DIR, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blobs_dir = root / "blobs"
+        self.parsed_dir = root / "parsed"
+        self.index_path = root / "index.json"
+        # ключ страницы -> хэш, ETag, Last-Modified; порядок - от давно использованных к свежим
+        self.index: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.blob_refs: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.not_modified = 0
+        self.parses = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._save_lock = asyncio.Lock()
+        self._index_dirty = False
+        self._index_saved_at = 0.0
+
+    def _load(self):
+        """Чтение индекса с диска; выполняется в отдельном потоке"""
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self.parsed_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            entries = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            entries = []
+        except Exception as e:
+            logger.warning(f"Page cache index is unreadable, starting empty: {e}")
+            entries = []
+
+        for key, entry in entries:
+            if not self._blob_path(entry["hash"]).exists():
+                continue
+            self.index[key] = entry
+            self._add_ref(entry)
+        self._index_saved_at = time.monotonic()
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await asyncio.to_thread(self._load)
+                self._loaded = True
+
+    async def _save_index(self, force: bool = True):
+        """
+        Сохранение индекса. Новые и вытесненные страницы сохраняются сразу,
+        а одни лишь обращения к неизменившимся страницам - не чаще INDEX_SAVE_INTERVAL
+        """
+        self._index_dirty = True
+        if not force and time.monotonic() - self._index_saved_at < INDEX_SAVE_INTERVAL:
+            return
+        async with self._save_lock:
+            if not self._index_dirty:
+                return
+            self._index_dirty = False
+            self._index_saved_at = time.monotonic()
+            data = json.dumps(list(self.index.items())).encode("utf-8")
+            await asyncio.to_thread(_atomic_write, self.index_path, data)
+
+    async def flush(self):
+        """Сохранение отложенных изменений индекса (при остановке приложения)"""
+        if self._loaded and self._index_dirty:
+            await self._save_index()
+
+    def _blob_path(self, content_hash: str) -> Path:
+        return self.blobs_dir / f"{content_hash}.html"
+
+    def _parsed_path(self, content_hash: str, parser_id: str) -> Path:
+        return self.parsed_dir / f"{content_hash}.{parser_id}.json"
+
+    def _add_ref(self, entry: Dict[str, Any]):
+        content_hash = entry["hash"]
+        if self.blob_refs.get(content_hash, 0) == 0:
+            self.total_bytes += entry["size"]
+        self.blob_refs[content_hash] = self.blob_refs.get(content_hash, 0) + 1
+
+    def _drop_ref(self, entry: Dict[str, Any]) -> Optional[str]:
+        """Снятие ссылки; возвращает хэш блоба, на который больше никто не ссылается"""
+        content_hash = entry["hash"]
+        self.blob_refs[content_hash] -= 1
+        if self.blob_refs[content_hash] > 0:
+            return None
+        del self.blob_refs[content_hash]
+        self.total_bytes -= entry["size"]
+        return content_hash
+
+    def _delete_blobs(self, hashes: List[str]):
+        """Удаление блобов и результатов их разбора; выполняется в отдельном потоке"""
+        for content_hash in hashes:
+            # Пока шло удаление, на то же содержимое могла появиться новая ссылка
+            if content_hash in self.blob_refs:
+                continue
+            self._blob_path(content_hash).unlink(missing_ok=True)
+            for parsed in self.parsed_dir.glob(f"{content_hash}.*.json"):
+                parsed.unlink(missing_ok=True)
+
+    def _evict(self) -> List[str]:
+        unused = []
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            key, entry = self.index.popitem(last=False)
+            logger.debug(f"Evicting cached page {key}")
+            content_hash = self._drop_ref(entry)
+            if content_hash:
+                unused.append(content_hash)
+        return unused
+
+    def read_page(self, content_hash: str) -> Optional[str]:
+        """Сырой HTML из кэша; блокирующее чтение"""
+        try:
+            return self._blob_path(content_hash).read_bytes().decode("utf-8", errors="replace")
+        except FileNotFoundError:
+            return None
+
+    def _load_parsed(self, content_hash: str, parser_id: str) -> Optional[Any]:
+        try:
+            return json.loads(self._parsed_path(content_hash, parser_id).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _parse_and_store(self, content_hash: str, parser_id: str, html: str, parser: Callable[[str], Any]) -> Any:
+        """Разбор и сохранение результата; выполняется в отдельном потоке"""
+        result = parser(html)
+        if result is not None:
+            _atomic_write(
+                self._parsed_path(content_hash, parser_id),
+                json.dumps(result, ensure_ascii=False, default=str).encode("utf-8")
+            )
+        return result
+
+    def _write_blob(self, content_hash: str, body: bytes):
+        blob_path = self._blob_path(content_hash)
+        if not blob_path.exists():
+            _atomic_write(blob_path, body)
+
+    async def _store(self, key: str, content_hash: str, body: bytes, headers) -> Dict[str, Any]:
+        old_entry = self.index.pop(key, None)
+        entry = {
+            "hash": content_hash,
+            "size": len(body),
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "fetched_at": time.time()
+        }
+        self.index[key] = entry
+        # Ссылка берётся до записи, чтобы параллельное вытеснение не удалило этот блоб
+        self._add_ref(entry)
+        unused = []
+        if old_entry:
+            old_hash = self._drop_ref(old_entry)
+            if old_hash:
+                unused.append(old_hash)
+        unused.extend(self._evict())
+
+        await asyncio.to_thread(self._write_blob, content_hash, body)
+        if unused:
+            await asyncio.to_thread(self._delete_blobs, unused)
+        await self._save_index()
+        return entry
+
+    @staticmethod
+    def _refresh_validators(entry: Dict[str, Any], headers) -> bool:
+        changed = False
+        for field, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+            value = headers.get(header) if headers else None
+            if value and value != entry.get(field):
+                entry[field] = value
+                changed = True
+        return changed
+
+    async def get_parsed(self, key: str, url: str, parser: Callable[[str], Any], parser_id: str) -> Optional[Any]:
+        """
+        Разобранная страница: условный запрос к источнику, разбор только при новом содержимом.
+        parser_id отделяет результаты разных парсеров и их версий
+        """
+        await self._ensure_loaded()
+        entry = self.index.get(key)
+
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        result = await scraper_pool.fetch_page(url, headers or None)
+        if result is None:
+            return None
+
+        validators = None
+        if result.status == 304 and entry:
+            self.not_modified += 1
+            content_hash = entry["hash"]
+            validators = result.headers
+        elif 200 <= result.status < 300:
+            body, content_hash = await asyncio.to_thread(_digest, result.text)
+            if not entry or entry["hash"] != content_hash:
+                await self._store(key, content_hash, body, result.headers)
+                self.parses += 1
+                return await asyncio.to_thread(self._parse_and_store, content_hash, parser_id, result.text, parser)
+            self.hits += 1
+            validators = result.headers
+        else:
+            return None
+
+        if self.index.get(key) is entry:
+            entry["fetched_at"] = time.time()
+            self.index.move_to_end(key)
+            # Источник мог сменить ETag при том же содержимом: без обновления
+            # условные запросы со старым ETag больше не получат 304
+            changed = self._refresh_validators(entry, validators)
+            await self._save_index(force=changed)
+
+        # Содержимое не изменилось - берём прошлый результат разбора
+        parsed = await asyncio.to_thread(self._load_parsed, content_hash, parser_id)
+        if parsed is not None:
+            return parsed
+        html = await asyncio.to_thread(self.read_page, content_hash)
+        if not html:
+            return None
+        self.parses += 1
+        return await asyncio.to_thread(self._parse_and_store, content_hash, parser_id, html, parser)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pages": len(self.index),
+            "blobs": len(self.blob_refs),
+            "size_mb": round(self.total_bytes / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "unchanged_hits": self.hits,
+            "not_modified": self.not_modified,
+            "parses": self.parses
+        }
+
+
+# Глобальный экземпляр дискового кэша страниц
+page_cache = PageCache()
@@ -0,0 +1,178 @@
+"""
+Scraper Pool - пул прогретых cloudscraper-сессий для страниц за Cloudflare
+Сессии переиспользуют полученные cookies, отслеживают здоровье и пересоздаются
+при сбоях; запросы ждут свободную сессию в очереди
+"""
+
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, AsyncIterator, NamedTuple, Mapping
+
+import cloudscraper
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("SCRAPER_POOL_SIZE", "4"))
+ACQUIRE_TIMEOUT = float(os.getenv("SCRAPER_ACQUIRE_TIMEOUT", "30.0"))
+REQUEST_TIMEOUT = float(os.getenv("SCRAPER_REQUEST_TIMEOUT", "30.0"))
+MAX_FAILURES = int(os.getenv("SCRAPER_MAX_FAILURES", "3"))
+MAX_SESSION_AGE = int(os.getenv("SCRAPER_MAX_SESSION_AGE", "1800"))  # 30 минут
+MAX_SESSION_REQUESTS = int(os.getenv("SCRAPER_MAX_SESSION_REQUESTS", "500"))
+
+CHALLENGE_MARKERS = ("Just a moment", "Один момент", "cf-challenge", "challenge-platform")
+
+
+class FetchResult(NamedTuple):
+    status: int
+    text: str
+    headers: Mapping[str, str]  # без учёта регистра, как в requests
+
+
+class PoolExhaustedError(Exception):
+    """Нет свободной сессии за отведённое время"""
+
+
+class PooledSession:
+    """Сессия cloudscraper со своими cookies и статистикой здоровья"""
+
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.scraper = cloudscraper.create_scraper(
+            browser={"browser": "chrome", "platform": "windows", "mobile": False}
+        )
+        self.created_at = time.monotonic()
+        self.requests = 0
+        self.failures = 0
+        self.challenges = 0
+
+    @property
+    def healthy(self) -> bool:
+        return (
+            self.failures < MAX_FAILURES
+            and self.requests < MAX_SESSION_REQUESTS
+            and time.monotonic() - self.created_at < MAX_SESSION_AGE
+        )
+
+    @property
+    def has_clearance(self) -> bool:
+        return "cf_clearance" in self.scraper.cookies
+
+    def request(self, url: str, headers: Optional[Dict[str, str]] = None) -> Optional[FetchResult]:
+        """Блокирующий запрос; выполняется в отдельном потоке"""
+        self.requests += 1
+        try:
+            response = self.scraper.get(url, timeout=REQUEST_TIMEOUT, headers=headers)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Scraper session {self.session_id} request failed: {e}")
+            return None
+
+        if response.status_code in (403, 429, 503) or any(m in response.text[:5000] for m in CHALLENGE_MARKERS):
+            self.failures += 1
+            self.challenges += 1
+            logger.warning(f"Scraper session {self.session_id} got challenge/HTTP {response.status_code} for {url}")
+            return None
+
+        # 404 и прочие ошибки страницы не говорят о плохой сессии
+        self.failures = 0
+        return FetchResult(response.status_code, response.text, response.headers)
+
+    def close(self):
+        try:
+            self.scraper.close()
+        except Exception:
+            pass
+
+
+class ScraperPool:
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = max(1, size)
+        self._idle: Optional[asyncio.Queue] = None
+        self._sessions: Dict[int, PooledSession] = {}
+        self._next_id = 0
+        self.recycled = 0
+
+    def _new_session(self) -> PooledSession:
+        self._next_id += 1
+        session = PooledSession(self._next_id)
+        self._sessions[session.session_id] = session
+        return session
+
+    def _ensure_started(self) -> asyncio.Queue:
+        # Очередь создаётся лениво, внутри работающего event loop
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                self._idle.put_nowait(self._new_session())
+        return self._idle
+
+    def _recycle(self, session: PooledSession) -> PooledSession:
+        logger.info(
+            f"Recycling scraper session {session.session_id}: {session.requests} requests, "
+            f"{session.failures} consecutive failures"
+        )
+        self._sessions.pop(session.session_id, None)
+        session.close()
+        self.recycled += 1
+        return self._new_session()
+
+    async def _acquire(self) -> PooledSession:
+        idle = self._ensure_started()
+        try:
+            session = await asyncio.wait_for(idle.get(), ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolExhaustedError(f"No scraper session available within {ACQUIRE_TIMEOUT}s")
+        # Сессия могла устареть, пока лежала в очереди
+        if not session.healthy:
+            session = self._recycle(session)
+        return session
+
+    def _release(self, session: PooledSession):
+        if self._idle is None or session.session_id not in self._sessions:
+            # Пул закрыт, пока сессия была занята
+            session.close()
+            return
+        if not session.healthy:
+            session = self._recycle(session)
+        self._idle.put_nowait(session)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[PooledSession]:
+        """Эксклюзивная сессия из пула; ожидающие запросы встают в очередь"""
+        session = await self._acquire()
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    async def fetch_page(self, url: str, headers: Optional[Dict[str, str]] = None) -> Optional[FetchResult]:
+        """Ответ целиком (статус, тело, заголовки) - для условных запросов"""
+        session = await self._acquire()
+        request = asyncio.ensure_future(asyncio.to_thread(session.request, url, headers))
+        # Отмена вызывающего не останавливает поток: сессия вернётся в пул, только когда он закончит
+        request.add_done_callback(lambda _: self._release(session))
+        return await asyncio.shield(request)
+
+    async def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+        self._idle = None
+
+    def stats(self) -> Dict[str, Any]:
+        sessions: List[PooledSession] = list(self._sessions.values())
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle else self.size,
+            "with_clearance": sum(1 for s in sessions if s.has_clearance),
+            "requests": sum(s.requests for s in sessions),
+            "challenges": sum(s.challenges for s in sessions),
+            "recycled": self.recycled
+        }
+
+
+# Глобальный пул сессий скрейпера
+scraper_pool = ScraperPool()
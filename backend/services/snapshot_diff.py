@@ -0,0 +1,30 @@
+"""
+Snapshot Diff - плоское представление вложенных данных и сравнение снимков
+Без зависимостей от других сервисов: используется и хабом уведомлений, и офлайн-инструментами
+"""
+
+import json
+from typing import Dict, Any, List
+
+
+def flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Плоское представление: вложенные ключи через точку, списки сериализуются целиком"""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, list):
+            flat[path] = json.dumps(value, sort_keys=True, default=str)
+        else:
+            flat[path] = value
+    return flat
+
+
+def diff(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Список изменённых полей между двумя плоскими снимками"""
+    changes = []
+    for field in sorted(old.keys() | new.keys()):
+        if old.get(field) != new.get(field):
+            changes.append({"field": field, "old": old.get(field), "new": new.get(field)})
+    return changes
@@ -0,0 +1,170 @@
+"""
+Tracing Service - трассировка запросов
+Request-scoped спаны в формате, совместимом с OpenTelemetry, поверх structlog
+"""
+
+import os
+import time
+import asyncio
+import secrets
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Iterator
+
+import structlog
+
+# Куда выгружать спаны: console, file или none
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "console")
+TRACE_FILE = os.getenv("TRACE_FILE", "logs/traces.jsonl")
+
+_current_trace: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    """Один этап обработки запроса"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "UNSET"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._perf_start = time.perf_counter()
+        self._perf_end: Optional[float] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self._perf_end if self._perf_end is not None else time.perf_counter()
+        return (end - self._perf_start) * 1000
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, status: str = "OK"):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        self._perf_end = time.perf_counter()
+        if self.status == "UNSET":
+            self.status = status
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Представление спана в духе OTLP/JSON"""
+        return {
+            "name": self.name,
+            "context": {"trace_id": self.trace_id, "span_id": self.span_id},
+            "parent_id": self.parent_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": {"status_code": self.status},
+        }
+
+
+class RequestTrace:
+    """Все спаны одного HTTP-запроса"""
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, self.trace_id, attributes=attributes)
+        self.spans: List[Span] = []
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing по завершённым этапам"""
+        entries = []
+        for span in self.spans:
+            if span.end_ns is None:
+                continue
+            entry = f"{span.name};dur={span.duration_ms:.1f}"
+            source = span.attributes.get("source")
+            if source:
+                entry += f';desc="{source}"'
+            entries.append(entry)
+        if self.root.end_ns is not None:
+            entries.append(f"total;dur={self.root.duration_ms:.1f}")
+        return ", ".join(entries)
+
+
+class TracingService:
+    def __init__(self):
+        self.exporter = TRACE_EXPORTER
+        self.logger = self._configure_logger()
+
+    def _configure_logger(self):
+        """Настройка structlog-экспортера спанов"""
+        if self.exporter == "file":
+            directory = os.path.dirname(TRACE_FILE)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            logger_factory = structlog.WriteLoggerFactory(file=open(TRACE_FILE, "a"))
+        else:
+            logger_factory = structlog.PrintLoggerFactory()
+
+        return structlog.wrap_logger(
+            logger_factory(),
+            processors=[
+                structlog.processors.add_log_level,
+                structlog.processors.TimeStamper(fmt="iso"),
+                structlog.processors.JSONRenderer(),
+            ],
+        ).bind(service="gamestats-api")
+
+    def _export(self, span: Span):
+        if self.exporter == "none":
+            return
+        self.logger.info("span", **span.to_dict())
+
+    def start_trace(self, name: str, **attributes) -> RequestTrace:
+        """Начало трассировки запроса в текущем контексте"""
+        trace = RequestTrace(name, attributes)
+        _current_trace.set(trace)
+        _current_span.set(trace.root)
+        return trace
+
+    def end_trace(self, trace: RequestTrace, status: str = "OK"):
+        """Завершение трассировки и выгрузка корневого спана"""
+        trace.root.end(status)
+        self._export(trace.root)
+
+    def current_trace(self) -> Optional[RequestTrace]:
+        return _current_trace.get()
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Этап внутри текущего запроса; вне запроса создаёт отдельный трейс"""
+        trace = _current_trace.get()
+        parent = _current_span.get()
+        trace_id = trace.trace_id if trace else secrets.token_hex(16)
+        span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            # Отменённые этапы (например, лишние регионы в region=auto) не считаются успешными
+            span.status = "ERROR"
+            span.set_attribute("cancelled", True)
+            raise
+        except Exception as e:
+            span.status = "ERROR"
+            span.set_attribute("exception.message", str(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            if trace:
+                trace.spans.append(span)
+            self._export(span)
+
+
+# Глобальный экземпляр сервиса трассировки
+tracing_service = TracingService()
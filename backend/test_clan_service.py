@@ -0,0 +1,163 @@
+"""
+Тесты синхронизации клана: диф состава и инкрементальные агрегаты
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from services import clan_service as clan_module
+from services.clan_service import ClanService, diff_roster, _empty_aggregates
+
+
+def member(rating=100, activity=10, role="Рядовой", joined="01.01.2024"):
+    return {"clan_rating": rating, "activity": activity, "role": role, "joined": joined}
+
+
+def stats(battles=100, wins=50, kills=80, deaths=40):
+    return {"battles": battles, "wins": wins, "kills": kills, "deaths": deaths}
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = ClanService()
+    rosters = []
+    member_stats = {}
+    refreshed = []
+
+    async def fetch_roster(clan_id, region="en"):
+        return rosters.pop(0)
+
+    async def fetch_member_stats(nick, region):
+        refreshed.append(nick)
+        return member_stats.get(nick)
+
+    async def load_state(key):
+        return service.states.setdefault(key, {
+            "roster": {}, "member_stats": {}, "aggregates": _empty_aggregates(),
+            "change_log": [], "refresh_failures": {}
+        })
+
+    async def store_state(key, state):
+        service.states[key] = state
+
+    monkeypatch.setattr(service, "fetch_roster", fetch_roster)
+    monkeypatch.setattr(service, "_fetch_member_stats", fetch_member_stats)
+    monkeypatch.setattr(service, "_load_state", load_state)
+    monkeypatch.setattr(service, "_store_state", store_state)
+    service.rosters = rosters
+    service.member_stats = member_stats
+    service.refreshed = refreshed
+    return service
+
+
+def test_diff_roster_detects_joined_left_and_changed():
+    old = {"alpha": member(), "bravo": member(), "charlie": member()}
+    new = {"alpha": member(), "bravo": member(rating=150), "delta": member()}
+
+    assert diff_roster(old, new) == {"joined": ["delta"], "left": ["charlie"], "changed": ["bravo"]}
+
+
+def test_diff_roster_of_identical_rosters_is_empty():
+    roster = {"alpha": member(), "bravo": member(role="Офицер")}
+
+    assert diff_roster(roster, dict(roster)) == {"joined": [], "left": [], "changed": []}
+
+
+def test_aggregates_follow_members_joining_and_leaving(service):
+    service.member_stats.update(alpha=stats(battles=100, wins=60), bravo=stats(battles=300, wins=150))
+    service.rosters.append({"alpha": member(rating=100), "bravo": member(rating=300, role="Офицер")})
+    first = asyncio.run(service.sync_clan("clan"))
+
+    aggregates = first["aggregates"]
+    assert aggregates["members"] == 2
+    assert aggregates["clan_rating"] == 400
+    assert aggregates["roles"] == {"Рядовой": 1, "Офицер": 1}
+    assert aggregates["battles"] == 400
+    assert aggregates["wins"] == 210
+    assert aggregates["tracked_members"] == 2
+
+    service.rosters.append({"alpha": member(rating=100)})
+    second = asyncio.run(service.sync_clan("clan"))
+
+    aggregates = second["aggregates"]
+    assert aggregates["members"] == 1
+    assert aggregates["clan_rating"] == 100
+    assert aggregates["roles"] == {"Рядовой": 1}
+    assert aggregates["battles"] == 100
+    assert aggregates["wins"] == 60
+    assert aggregates["tracked_members"] == 1
+
+
+def test_only_changed_members_are_refreshed(service):
+    service.member_stats.update(alpha=stats(), bravo=stats())
+    service.rosters.append({"alpha": member(), "bravo": member()})
+    asyncio.run(service.sync_clan("clan"))
+    service.refreshed.clear()
+
+    service.member_stats["bravo"] = stats(battles=120, wins=70)
+    service.rosters.append({"alpha": member(), "bravo": member(activity=20)})
+    result = asyncio.run(service.sync_clan("clan"))
+
+    assert service.refreshed == ["bravo"]
+    assert result["aggregates"]["battles"] == 220
+    assert result["aggregates"]["activity"] == 30
+
+
+def test_change_log_is_kept_and_filtered_by_since(service):
+    service.rosters.append({"alpha": member()})
+    first = asyncio.run(service.sync_clan("clan"))
+    assert first["changes"] == []
+
+    service.rosters.append({"alpha": member(), "bravo": member()})
+    second = asyncio.run(service.sync_clan("clan"))
+    service.rosters.append({"bravo": member()})
+    third = asyncio.run(service.sync_clan("clan"))
+
+    # Синхронизация другим клиентом не съедает изменения
+    assert [entry["joined"] for entry in third["changes"]] == [["bravo"], []]
+    assert [entry["left"] for entry in third["changes"]] == [[], ["alpha"]]
+
+    service.rosters.append({"bravo": member()})
+    since = datetime.fromisoformat(second["last_sync"])
+    fourth = asyncio.run(service.sync_clan("clan", since=since))
+    assert [entry["left"] for entry in fourth["changes"]] == [["alpha"]]
+
+
+def test_member_refreshes_are_capped_per_sync(service, monkeypatch):
+    monkeypatch.setattr(clan_module, "MAX_REFRESHES_PER_SYNC", 2)
+    roster = {nick: member() for nick in ("alpha", "bravo", "charlie")}
+    service.member_stats.update({nick: stats() for nick in roster})
+
+    service.rosters.append(roster)
+    first = asyncio.run(service.sync_clan("clan"))
+    assert service.refreshed == ["alpha", "bravo"]
+    assert first["aggregates"]["tracked_members"] == 2
+
+    service.rosters.append(roster)
+    second = asyncio.run(service.sync_clan("clan"))
+    assert service.refreshed[2:] == ["charlie"]
+    assert second["aggregates"]["tracked_members"] == 3
+
+
+def test_failed_refreshes_are_not_retried_until_backoff_expires(service, monkeypatch):
+    roster = {"alpha": member(), "bravo": member()}
+    service.member_stats.update(alpha=stats())
+
+    service.rosters.append(roster)
+    asyncio.run(service.sync_clan("clan"))
+    assert service.refreshed == ["alpha", "bravo"]
+
+    # bravo недоступен (Cloudflare) - повторные синхронизации его не трогают
+    service.rosters.append(roster)
+    asyncio.run(service.sync_clan("clan"))
+    assert service.refreshed == ["alpha", "bravo"]
+
+    monkeypatch.setattr(clan_module, "REFRESH_RETRY_AFTER", 0)
+    service.member_stats.update(bravo=stats())
+    service.rosters.append(roster)
+    result = asyncio.run(service.sync_clan("clan"))
+    assert service.refreshed == ["alpha", "bravo", "bravo"]
+    assert result["aggregates"]["tracked_members"] == 2
+    assert service.states["en:clan"]["refresh_failures"] == {}
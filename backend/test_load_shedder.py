@@ -0,0 +1,188 @@
+"""
+Тесты адаптивного ограничителя: AIMD, взвешенные слоты и отказ 503 в /player
+"""
+
+import time
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import load_shedder as load_shedder_module
+from services.load_shedder import AdaptiveLimiter, LoadShedder, OverloadedError, load_shedder
+
+
+@pytest.fixture
+def limiter():
+    limiter = AdaptiveLimiter("player", target_latency=1.0)
+    limiter.limit = 10.0
+    return limiter
+
+
+def test_fast_successes_increase_the_limit_additively(limiter):
+    assert limiter.try_acquire()
+    limiter.release(0.1)
+
+    assert limiter.limit == pytest.approx(10.1)
+    assert limiter.in_flight == 0
+
+
+def test_weighted_success_increases_by_its_weight(limiter):
+    assert limiter.try_acquire(4)
+    limiter.release(0.1, weight=4)
+
+    assert limiter.limit == pytest.approx(10.4)
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize("latency, success", [(2.0, True), (0.1, False)])
+def test_slow_or_failed_requests_decrease_the_limit(limiter, latency, success):
+    limiter.try_acquire()
+    limiter.release(latency, success)
+
+    assert limiter.limit == pytest.approx(10 * load_shedder_module.BACKOFF_RATIO)
+
+
+def test_decrease_happens_once_per_target_latency_window(limiter):
+    for _ in range(5):
+        limiter.try_acquire()
+        limiter.release(2.0)
+    assert limiter.limit == pytest.approx(10 * load_shedder_module.BACKOFF_RATIO)
+
+    limiter.last_decrease = time.monotonic() - limiter.target_latency
+    limiter.try_acquire()
+    limiter.release(2.0)
+    assert limiter.limit == pytest.approx(10 * load_shedder_module.BACKOFF_RATIO ** 2)
+
+
+def test_limit_stays_within_bounds(limiter):
+    limiter.limit = load_shedder_module.MIN_LIMIT
+    limiter.release(0.1, success=False)
+    assert limiter.limit == load_shedder_module.MIN_LIMIT
+
+    limiter.limit = load_shedder_module.MAX_LIMIT
+    limiter.release(0.1)
+    assert limiter.limit == load_shedder_module.MAX_LIMIT
+
+
+def test_admission_respects_weights(limiter):
+    assert limiter.try_acquire(8)
+    assert not limiter.try_acquire(4)
+    assert limiter.try_acquire(2)
+    assert not limiter.try_acquire(1)
+    assert (limiter.accepted, limiter.rejected) == (2, 2)
+
+
+def test_overweight_request_is_admitted_when_idle(limiter):
+    limiter.limit = 2.0
+
+    assert limiter.try_acquire(4)
+    assert limiter.in_flight == 4
+    assert not limiter.try_acquire(1)
+
+
+def test_slot_marks_fallback_and_exceptions_as_failures():
+    shedder = LoadShedder()
+
+    async def scenario():
+        async with shedder.slot("player") as slot:
+            slot.mark_failed()
+        with pytest.raises(RuntimeError):
+            async with shedder.slot("compare"):
+                raise RuntimeError("upstream")
+
+    asyncio.run(scenario())
+
+    initial = load_shedder_module.INITIAL_LIMIT
+    assert shedder.get_limiter("player").limit == pytest.approx(initial * load_shedder_module.BACKOFF_RATIO)
+    assert shedder.get_limiter("compare").limit == pytest.approx(initial * load_shedder_module.BACKOFF_RATIO)
+    assert shedder.get_limiter("player").in_flight == 0
+
+
+def test_slot_raises_overloaded_with_retry_after():
+    shedder = LoadShedder()
+    limiter = shedder.get_limiter("top")
+    limiter.in_flight = int(limiter.limit)
+    limiter.avg_latency = 2.3
+
+    async def scenario():
+        async with shedder.slot("top"):
+            pass
+
+    with pytest.raises(OverloadedError) as error:
+        asyncio.run(scenario())
+    assert error.value.retry_after == 3
+
+
+class FakePlayerService:
+    def __init__(self, response=None):
+        self.response = response
+        self.calls = 0
+
+    async def get_player_stats(self, username, region="en"):
+        self.calls += 1
+        return self.response
+
+
+@pytest.fixture
+def client(monkeypatch):
+    main.cache.clear()
+    main.player_regions.clear()
+    load_shedder.limiters.clear()
+    yield TestClient(main.app)
+    main.cache.clear()
+    main.player_regions.clear()
+    load_shedder.limiters.clear()
+
+
+def saturate(route):
+    limiter = load_shedder.get_limiter(route)
+    limiter.in_flight = int(limiter.limit)
+    return limiter
+
+
+def test_player_sheds_with_503_and_retry_after(client, monkeypatch):
+    service = FakePlayerService()
+    monkeypatch.setattr(main, "player_service", service)
+    saturate("player").avg_latency = 4.2
+
+    response = client.get("/player/alpha")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert service.calls == 0
+
+
+def test_player_serves_stale_cache_when_shed(client, monkeypatch):
+    service = FakePlayerService()
+    monkeypatch.setattr(main, "player_service", service)
+    stale = {"username": "alpha", "general": {"kills": 10, "deaths": 5}, "__source__": "player_service"}
+    main.cache["alpha:en"] = (time.time() - main.CACHE_DURATION - 1, stale)
+    saturate("player")
+
+    response = client.get("/player/alpha", params={"region": "en"})
+
+    assert response.status_code == 200
+    assert response.json()["source"] == "stale_cache"
+    assert service.calls == 0
+
+
+def test_player_fresh_cache_bypasses_the_limiter(client, monkeypatch):
+    monkeypatch.setattr(main, "player_service", FakePlayerService())
+    main.cache["alpha:en"] = (time.time(), {"username": "alpha", "general": {}, "__source__": "player_service"})
+    saturate("player")
+
+    assert client.get("/player/alpha").status_code == 200
+
+
+def test_player_fallback_counts_as_limiter_failure(client, monkeypatch):
+    monkeypatch.setattr(main, "player_service", FakePlayerService({"username": "alpha", "__source__": "fallback"}))
+
+    response = client.get("/player/alpha")
+
+    assert response.status_code == 200
+    assert response.json()["source"] == "fallback"
+    limiter = load_shedder.get_limiter("player")
+    assert limiter.limit < load_shedder_module.INITIAL_LIMIT
+    assert limiter.in_flight == 0
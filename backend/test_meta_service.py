@@ -0,0 +1,95 @@
+"""
+Тесты скетча квантилей и агрегатов меты
+"""
+
+import pytest
+
+from services.meta_service import QuantileSketch, MetaService
+
+ACCURACY = 0.01
+
+
+def sketch_of(values):
+    sketch = QuantileSketch(ACCURACY)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+@pytest.mark.parametrize("q", [0.0, 0.25, 0.5, 0.75, 0.9, 1.0])
+def test_quantiles_within_relative_accuracy(q):
+    values = [0.1 + i * 0.007 for i in range(1000)]
+    sketch = sketch_of(values)
+
+    assert sketch.quantile(q) == pytest.approx(exact_quantile(values, q), rel=ACCURACY)
+
+
+def test_empty_sketch_has_no_quantiles():
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_zero_values_are_counted_separately():
+    sketch = sketch_of([0, 0, 0, 2.0])
+
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(2.0, rel=ACCURACY)
+
+
+def test_remove_restores_previous_distribution():
+    base = [0.4, 0.5, 0.6, 0.7]
+    sketch = sketch_of(base)
+    expected = {q: sketch.quantile(q) for q in (0.25, 0.5, 0.75)}
+
+    for value in (5.0, 9.0, 12.0):
+        sketch.add(value)
+    for value in (5.0, 9.0, 12.0):
+        sketch.remove(value)
+
+    assert sketch.count == len(base)
+    assert {q: sketch.quantile(q) for q in expected} == expected
+    assert all(weight > 0 for weight in sketch.bins.values())
+
+
+def test_merge_matches_sketch_of_all_values():
+    left = [0.2 + i * 0.01 for i in range(300)]
+    right = [1.5 + i * 0.02 for i in range(200)]
+    merged = sketch_of(left)
+    merged.merge(sketch_of(right))
+    combined = sketch_of(left + right)
+
+    assert merged.count == combined.count
+    for q in (0.1, 0.5, 0.9):
+        assert merged.quantile(q) == combined.quantile(q)
+
+
+def player(vehicles):
+    return {"top_vehicles": [
+        {"name": name, "battles": battles, "wins": wins, "kills": battles, "deaths": battles}
+        for name, battles, wins in vehicles
+    ]}
+
+
+def test_record_player_counts_only_the_latest_snapshot():
+    service = MetaService()
+    service.record_player("alpha", "en", player([("T-34", 100, 50), ("Tiger", 40, 20)]))
+    service.record_player("alpha", "en", player([("T-34", 110, 56)]))
+
+    meta = service.get_meta("en")
+    assert [v["name"] for v in meta["vehicles"]] == ["T-34"]
+    assert meta["vehicles"][0]["battles"] == 110
+    assert meta["vehicles"][0]["players"] == 1
+
+    window = service.get_meta("en", "24h")
+    assert window["vehicles"][0]["battles"] == 10
+
+
+def test_fallback_data_is_not_recorded():
+    service = MetaService()
+    service.record_player("alpha", "en", {**player([("T-34", 100, 50)]), "__source__": "demo_data"})
+
+    assert service.get_meta()["total_vehicles"] == 0
@@ -0,0 +1,154 @@
+"""
+Тесты дискового кэша страниц: условные запросы, повторный разбор, счётчики ссылок и вытеснение
+"""
+
+import asyncio
+
+import pytest
+
+from services import page_cache as page_cache_module
+from services.page_cache import PageCache
+from services.scraper_pool import FetchResult
+
+
+class FakePool:
+    """Ответы источника по очереди; запоминает заголовки каждого запроса"""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def respond(self, status, text="", **headers):
+        self.responses.append(FetchResult(status, text, headers))
+
+    async def fetch_page(self, url, headers=None):
+        self.requests.append((url, headers or {}))
+        return self.responses.pop(0)
+
+
+class CountingParser:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, html):
+        self.calls += 1
+        return {"length": len(html)}
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(page_cache_module, "scraper_pool", pool)
+    return pool
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PageCache(tmp_path, max_bytes=1024)
+
+
+def get(cache, key, parser, parser_id="v1", url=None):
+    return asyncio.run(cache.get_parsed(key, url or f"https://example.com/{key}", parser, parser_id))
+
+
+def test_not_modified_reuses_stored_parse(cache, pool):
+    parser = CountingParser()
+    pool.respond(200, "<html>one</html>", ETag="e1", **{"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+    pool.respond(304)
+
+    assert get(cache, "page", parser) == {"length": 16}
+    assert get(cache, "page", parser) == {"length": 16}
+
+    assert parser.calls == 1
+    assert pool.requests[1][1] == {
+        "If-None-Match": "e1", "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"
+    }
+    assert cache.stats()["not_modified"] == 1
+
+
+def test_unchanged_body_refreshes_validators(cache, pool):
+    parser = CountingParser()
+    for etag in ("e1", "e2", "e3"):
+        pool.respond(200, "<html>same</html>", ETag=etag)
+        get(cache, "page", parser)
+
+    sent = [headers.get("If-None-Match") for _, headers in pool.requests]
+    assert sent == [None, "e1", "e2"]
+    assert parser.calls == 1
+    assert cache.stats()["unchanged_hits"] == 2
+
+
+def test_new_parser_id_reparses_cached_page(cache, pool):
+    old_parser, new_parser = CountingParser(), CountingParser()
+    pool.respond(200, "<html>one</html>", ETag="e1")
+    pool.respond(304)
+    pool.respond(304)
+
+    get(cache, "page", old_parser, "v1")
+    assert get(cache, "page", new_parser, "v2") == {"length": 16}
+    get(cache, "page", new_parser, "v2")
+
+    assert (old_parser.calls, new_parser.calls) == (1, 1)
+    parsed = sorted(path.name.split(".")[1] for path in cache.parsed_dir.iterdir())
+    assert parsed == ["v1", "v2"]
+
+
+def test_shared_content_is_stored_and_counted_once(cache, pool):
+    parser = CountingParser()
+    pool.respond(200, "<html>shared</html>")
+    pool.respond(200, "<html>shared</html>")
+
+    get(cache, "first", parser)
+    get(cache, "second", parser)
+
+    assert cache.stats()["blobs"] == 1
+    assert list(cache.blob_refs.values()) == [2]
+    assert cache.total_bytes == len("<html>shared</html>")
+    assert len(list(cache.blobs_dir.iterdir())) == 1
+
+
+def test_eviction_drops_only_unreferenced_blobs(cache, pool):
+    parser = CountingParser()
+    big = "x" * 600
+    pool.respond(200, f"<a>{big}</a>")
+    pool.respond(200, f"<a>{big}</a>")
+    pool.respond(200, f"<b>{big}</b>")
+
+    get(cache, "first", parser)
+    get(cache, "second", parser)
+    # Третья страница не помещается: вытесняются обе ссылки на первый блоб
+    get(cache, "third", parser)
+
+    assert list(cache.index) == ["third"]
+    assert cache.total_bytes == len(f"<b>{big}</b>")
+    assert len(list(cache.blobs_dir.iterdir())) == 1
+    assert len(list(cache.parsed_dir.iterdir())) == 1
+
+
+def test_replaced_page_releases_old_blob(cache, pool):
+    parser = CountingParser()
+    pool.respond(200, "<html>one</html>")
+    pool.respond(200, "<html>two</html>")
+
+    get(cache, "page", parser)
+    get(cache, "page", parser)
+
+    assert cache.stats()["blobs"] == 1
+    assert [path.read_text() for path in cache.blobs_dir.iterdir()] == ["<html>two</html>"]
+
+
+def test_index_survives_restart(tmp_path, pool):
+    parser = CountingParser()
+    cache = PageCache(tmp_path)
+    pool.respond(200, "<html>one</html>", ETag="e1")
+    pool.respond(200, "<html>one</html>", ETag="e2")
+    get(cache, "page", parser)
+    get(cache, "page", parser)
+    asyncio.run(cache.flush())
+
+    restarted = PageCache(tmp_path)
+    pool.respond(304)
+    assert get(restarted, "page", parser) == {"length": 16}
+    assert pool.requests[-1][1]["If-None-Match"] == "e2"
+    assert parser.calls == 1
+    assert not [path for path in tmp_path.rglob("*.tmp")]
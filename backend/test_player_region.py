@@ -0,0 +1,112 @@
+"""
+Тесты region=auto: поиск игрока по регионам, запоминание региона и поведение /player
+"""
+
+import time
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services.load_shedder import load_shedder
+
+
+def real(username, region):
+    return {"username": username, "general": {"kills": 10, "deaths": 5}, "__source__": f"real_{region}"}
+
+
+class FakePlayerService:
+    """Ответы профессионального сервиса по регионам с задержками"""
+
+    def __init__(self, responses, delays=None):
+        self.responses = responses
+        self.delays = delays or {}
+        self.calls = []
+
+    async def get_player_stats(self, username, region="en"):
+        self.calls.append(region)
+        await asyncio.sleep(self.delays.get(region, 0))
+        response = self.responses.get(region)
+        return response(username, region) if callable(response) else response
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    main.cache.clear()
+    main.player_regions.clear()
+    load_shedder.limiters.clear()
+
+    async def no_local_api(username, region):
+        raise AssertionError("region search must not use the local API")
+
+    monkeypatch.setattr(main.api, "_fetch_from_local_api", no_local_api)
+    yield
+    main.cache.clear()
+    main.player_regions.clear()
+    load_shedder.limiters.clear()
+
+
+def use_service(monkeypatch, responses, delays=None):
+    service = FakePlayerService(responses, delays)
+    monkeypatch.setattr(main, "player_service", service)
+    return service
+
+
+def test_demo_data_does_not_win_the_region_search(monkeypatch):
+    use_service(
+        monkeypatch,
+        {"en": {"__source__": "demo_data"}, "ru": None, "de": real, "fr": {"__source__": "fallback"}},
+        delays={"de": 0.05}
+    )
+
+    data = asyncio.run(main.api.fetch_player_stats("alpha", "auto"))
+
+    assert data["__region__"] == "de"
+    assert main.player_regions["alpha"][1] == "de"
+    assert list(main.cache) == ["alpha:de"]
+
+
+def test_not_found_everywhere_returns_the_service_answer(monkeypatch):
+    fallback = {"username": "ghost", "__source__": "fallback"}
+    use_service(monkeypatch, {region: fallback for region in main.REGIONS})
+
+    data = asyncio.run(main.api.fetch_player_stats("ghost", "auto"))
+
+    assert data == fallback
+    assert not main.player_regions
+    assert not main.cache
+
+
+def test_known_region_is_tried_first(monkeypatch):
+    service = use_service(monkeypatch, {"fr": real})
+    main.player_regions["alpha"] = (time.time(), "fr")
+
+    data = asyncio.run(main.api.fetch_player_stats("alpha", "auto"))
+
+    assert data["__region__"] == "fr"
+    assert service.calls == ["fr"]
+
+
+def test_player_auto_matches_explicit_region_when_not_found(monkeypatch):
+    use_service(monkeypatch, {region: {"username": "ghost", "__source__": "fallback"} for region in main.REGIONS})
+    client = TestClient(main.app)
+
+    explicit = client.get("/player/ghost", params={"region": "en"})
+    auto = client.get("/player/ghost", params={"region": "auto"})
+
+    assert explicit.status_code == auto.status_code == 200
+    assert explicit.json()["source"] == auto.json()["source"] == "fallback"
+
+
+def test_player_auto_serves_stale_cache_when_shed(monkeypatch):
+    use_service(monkeypatch, {})
+    main.cache["alpha:ru"] = (time.time() - main.CACHE_DURATION - 1, real("alpha", "ru"))
+    limiter = load_shedder.get_limiter("player")
+    limiter.in_flight = int(limiter.limit)
+
+    response = TestClient(main.app).get("/player/alpha", params={"region": "auto"})
+
+    assert response.status_code == 200
+    assert response.json()["source"] == "stale_cache"
+    assert response.json()["region"] == "ru"
@@ -0,0 +1,79 @@
+"""
+Тесты офлайн-прогона парсера: соглашение о вызове, загрузка парсера и диф с эталоном
+"""
+
+import json
+
+import pytest
+
+import replay_parser
+from replay_parser import takes_nickname, run_parser, load_parser
+
+
+def parse_title(html):
+    start = html.find("<title>") + len("<title>")
+    return {"title": html[start:html.find("</title>")], "meta": {"length": len(html)}}
+
+
+def parse_with_nickname(html, nickname):
+    return {"nickname": nickname}
+
+
+def parse_with_option(html, strict=False):
+    return {"strict": strict}
+
+
+async def parse_async(html):
+    return {"async": True}
+
+
+class Parser:
+    def parse(self, html, nickname):
+        return {"nickname": nickname}
+
+
+def test_nickname_is_passed_only_to_a_required_second_parameter():
+    assert takes_nickname(parse_with_nickname)
+    assert takes_nickname(Parser().parse)
+    assert not takes_nickname(parse_title)
+    assert not takes_nickname(parse_with_option)
+    assert not takes_nickname(lambda html, *args, **kwargs: None)
+
+
+def test_run_parser_calling_conventions():
+    assert run_parser(parse_with_nickname, "<html>", "alpha") == {"nickname": "alpha"}
+    assert run_parser(parse_with_option, "<html>", "alpha") == {"strict": False}
+    assert run_parser(parse_async, "<html>", "alpha") == {"async": True}
+
+
+def test_load_parser_reports_missing_module_and_attribute():
+    with pytest.raises(SystemExit, match="cannot import"):
+        load_parser("services.no_such_module:parse")
+    with pytest.raises(SystemExit, match="has no attribute"):
+        load_parser("test_replay_parser:no_such_parser")
+    with pytest.raises(SystemExit, match="module:attr"):
+        load_parser("test_replay_parser")
+    assert load_parser("test_replay_parser:Parser.parse") is Parser.parse
+
+
+def test_replay_writes_baseline_and_reports_field_diff(tmp_path, capsys):
+    corpus = tmp_path / "pages"
+    corpus.mkdir()
+    page = corpus / "debug_alpha.html"
+    page.write_text("<html><title>Alpha</title></html>", encoding="utf-8")
+    baseline = tmp_path / "baseline.json"
+    report = tmp_path / "report.json"
+
+    args = [str(corpus), "--parser", "test_replay_parser:parse_title", "--repeat", "1"]
+    assert replay_parser.main(args + ["--save-baseline", str(baseline)]) == 0
+    assert json.loads(baseline.read_text(encoding="utf-8")) == {
+        "debug_alpha.html": {"title": "Alpha", "meta.length": 33}
+    }
+
+    page.write_text("<html><title>Bravo</title></html>", encoding="utf-8")
+    assert replay_parser.main(args + ["--baseline", str(baseline), "--json", str(report)]) == 1
+
+    [page_report] = json.loads(report.read_text(encoding="utf-8"))
+    assert page_report["nickname"] == "alpha"
+    assert page_report["diff"] == [{"field": "title", "old": "Alpha", "new": "Bravo"}]
+    assert "title: 'Alpha' -> 'Bravo'" in capsys.readouterr().out
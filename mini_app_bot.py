@@ -5,11 +5,14 @@ War Thunder Statistics Telegram Bot
 """
 
 import os
+import time
 import asyncio
 import logging
-from typing import Optional, Dict, Any
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Awaitable, Tuple
 import httpx
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 
 # Настройка логирования
@@ -24,10 +27,198 @@ BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 BACKEND_URL = os.getenv('BACKEND_URL', 'https://warstats-backend-f6hw.onrender.com')
 DEFAULT_REGION = 'en'
 
+# Лимиты Telegram на исходящие сообщения
+GLOBAL_SEND_RATE = float(os.getenv('BOT_GLOBAL_SEND_RATE', '25'))  # сообщений в секунду на бота
+PRIVATE_CHAT_INTERVAL = float(os.getenv('BOT_PRIVATE_CHAT_INTERVAL', '1.0'))  # секунд между сообщениями в личке
+GROUP_CHAT_INTERVAL = float(os.getenv('BOT_GROUP_CHAT_INTERVAL', '3.0'))  # 20 сообщений в минуту в группе
+MAX_SEND_RETRIES = int(os.getenv('BOT_MAX_SEND_RETRIES', '5'))
+
+class _SendJob:
+    __slots__ = ('chat_id', 'call', 'key', 'future', 'attempts')
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable[Any]], key: Optional[Tuple[int, int]]):
+        self.chat_id = chat_id
+        self.call = call
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+class SendScheduler:
+    """Очередь исходящих сообщений с лимитами на чат и на бота, слиянием правок и повторами при flood wait"""
+
+    def __init__(self):
+        self.queues: Dict[int, deque] = {}
+        self.order: deque = deque()
+        self.busy: set = set()
+        self.next_allowed: Dict[int, float] = {}
+        self.pending_edits: Dict[Tuple[int, int], _SendJob] = {}
+        self.tokens = GLOBAL_SEND_RATE
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        # Ссылки на задачи отправки, чтобы сборщик мусора не удалил их до завершения
+        self.senders: set = set()
+
+    async def reply(self, message: Message, text: str, **kwargs) -> Message:
+        """Ответ в чат сообщения"""
+        return await self._submit(message.chat_id, lambda: message.reply_text(text, **kwargs))
+
+    async def edit(self, message: Message, text: str, **kwargs) -> Optional[Message]:
+        """Правка сообщения; правки одного сообщения в очереди сливаются в последнюю"""
+        key = (message.chat_id, message.message_id)
+        job = self.pending_edits.get(key)
+        if job is not None:
+            job.call = lambda: message.edit_text(text, **kwargs)
+            return await job.future
+        return await self._submit(message.chat_id, lambda: message.edit_text(text, **kwargs), key)
+
+    async def _submit(self, chat_id: int, call: Callable[[], Awaitable[Any]],
+                      key: Optional[Tuple[int, int]] = None) -> Any:
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+        job = _SendJob(chat_id, call, key)
+        if key is not None:
+            self.pending_edits[key] = job
+        self._enqueue(job)
+        return await job.future
+
+    def _enqueue(self, job: _SendJob, front: bool = False):
+        queue = self.queues.setdefault(job.chat_id, deque())
+        if not queue:
+            self.order.append(job.chat_id)
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self.wakeup.set()
+
+    def _chat_interval(self, chat_id: int) -> float:
+        return GROUP_CHAT_INTERVAL if chat_id < 0 else PRIVATE_CHAT_INTERVAL
+
+    def _take_token(self, now: float) -> float:
+        """Глобальный token bucket; возвращает, сколько ждать до следующего токена"""
+        self.tokens = min(GLOBAL_SEND_RATE, self.tokens + (now - self.last_refill) * GLOBAL_SEND_RATE)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / GLOBAL_SEND_RATE
+
+    def _next_ready(self, now: float) -> Tuple[Optional[int], float]:
+        """Первый по кругу чат, которому можно отправлять, или время ожидания"""
+        wait = 60.0
+        for _ in range(len(self.order)):
+            chat_id = self.order[0]
+            self.order.rotate(-1)
+            if chat_id in self.busy:
+                continue
+            ready_at = max(self.next_allowed.get(chat_id, 0.0), self.paused_until)
+            if ready_at <= now:
+                return chat_id, 0.0
+            wait = min(wait, ready_at - now)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            chat_id, wait = self._next_ready(now)
+            if chat_id is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            token_wait = self._take_token(now)
+            if token_wait:
+                await asyncio.sleep(token_wait)
+                continue
+
+            job = self.queues[chat_id].popleft()
+            if not self.queues[chat_id]:
+                del self.queues[chat_id]
+                self.order.remove(chat_id)
+            if job.key is not None and self.pending_edits.get(job.key) is job:
+                del self.pending_edits[job.key]
+            self.busy.add(chat_id)
+            self.next_allowed[chat_id] = now + self._chat_interval(chat_id)
+            sender = asyncio.create_task(self._send(job))
+            self.senders.add(sender)
+            sender.add_done_callback(self.senders.discard)
+
+    async def _send(self, job: _SendJob):
+        try:
+            result = await job.call()
+            if not job.future.done():
+                job.future.set_result(result)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+            logger.warning(f"Flood wait {delay}s for chat {job.chat_id}")
+            # Flood wait касается всего бота: приостанавливаем все чаты
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self._retry(job, e)
+        except BadRequest as e:
+            # BadRequest - подкласс NetworkError, но повторять его бессмысленно;
+            # повторная правка тем же текстом - не ошибка
+            if 'not modified' in str(e).lower():
+                if not job.future.done():
+                    job.future.set_result(None)
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except TimedOut as e:
+            # Сообщение могло дойти: повтор reply_text дал бы дубликат, а правка идемпотентна
+            if job.key is None:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self._backoff(job)
+                self._retry(job, e)
+        except NetworkError as e:
+            self._backoff(job)
+            self._retry(job, e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self.busy.discard(job.chat_id)
+            self.wakeup.set()
+
+    def _backoff(self, job: _SendJob):
+        self.next_allowed[job.chat_id] = time.monotonic() + min(2 ** job.attempts, 30)
+
+    def _retry(self, job: _SendJob, error: Exception):
+        job.attempts += 1
+        if job.attempts > MAX_SEND_RETRIES:
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        if job.key is not None:
+            newer = self.pending_edits.get(job.key)
+            if newer is not None:
+                # Уже есть более свежая правка этого сообщения - она и отправится
+                newer.future.add_done_callback(lambda f: self._chain(f, job.future))
+                return
+            self.pending_edits[job.key] = job
+        self._enqueue(job, front=True)
+
+    @staticmethod
+    def _chain(source: asyncio.Future, target: asyncio.Future):
+        if target.done():
+            return
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
 class WarThunderBot:
     def __init__(self):
         self.backend_url = BACKEND_URL
         self.session = httpx.AsyncClient(timeout=30.0)
+        self.sender = SendScheduler()
     
     async def get_player_stats(self, username: str, region: str = DEFAULT_REGION) -> Optional[Dict[str, Any]]:
         """Получение статистики игрока с backend API"""
@@ -142,12 +333,12 @@ class WarThunderBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
+        await self.sender.reply(update.message, welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
     
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /stats"""
         if not context.args:
-            await update.message.reply_text(
+            await self.sender.reply(update.message,
                 "❌ Укажите имя игрока!\n"
                 "Пример: `/stats PhlyDaily` или `/stats PlayerName ru`",
                 parse_mode='Markdown'
@@ -158,11 +349,11 @@ class WarThunderBot:
         region = context.args[1] if len(context.args) > 1 else DEFAULT_REGION
         
         if not username:
-            await update.message.reply_text("❌ Имя игрока не может быть пустым!")
+            await self.sender.reply(update.message, "❌ Имя игрока не может быть пустым!")
             return
         
         # Отправляем сообщение о загрузке
-        loading_msg = await update.message.reply_text(f"🔍 Загружаю статистику для {username}...")
+        loading_msg = await self.sender.reply(update.message, f"🔍 Загружаю статистику для {username}...")
         
         try:
             # Получаем данные
@@ -171,16 +362,16 @@ class WarThunderBot:
             if data:
                 # Форматируем и отправляем статистику
                 stats_message = await self.format_player_stats(data)
-                await loading_msg.edit_text(stats_message, parse_mode='Markdown')
+                await self.sender.edit(loading_msg, stats_message, parse_mode='Markdown')
             else:
-                await loading_msg.edit_text(
+                await self.sender.edit(loading_msg,
                     f"❌ Не удалось получить статистику для {username}\n"
                     "Проверьте правильность имени игрока и попробуйте снова."
                 )
                 
         except Exception as e:
             logger.error(f"Error in stats command: {e}")
-            await loading_msg.edit_text(
+            await self.sender.edit(loading_msg,
                 f"❌ Ошибка при получении статистики для {username}\n"
                 "Попробуйте позже или обратитесь к администратору."
             )
@@ -188,7 +379,7 @@ class WarThunderBot:
     async def compare_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /compare"""
         if len(context.args) < 2:
-            await update.message.reply_text(
+            await self.sender.reply(update.message,
                 "❌ Укажите двух игроков для сравнения!\n"
                 "Пример: `/compare Player1 Player2`",
                 parse_mode='Markdown'
@@ -200,11 +391,11 @@ class WarThunderBot:
         region = context.args[2] if len(context.args) > 2 else DEFAULT_REGION
         
         if not player1 or not player2:
-            await update.message.reply_text("❌ Имена игроков не могут быть пустыми!")
+            await self.sender.reply(update.message, "❌ Имена игроков не могут быть пустыми!")
             return
         
         # Отправляем сообщение о загрузке
-        loading_msg = await update.message.reply_text(f"🔍 Сравниваю {player1} и {player2}...")
+        loading_msg = await self.sender.reply(update.message, f"🔍 Сравниваю {player1} и {player2}...")
         
         try:
             # Получаем данные для обоих игроков
@@ -214,16 +405,16 @@ class WarThunderBot:
             if data1 and data2:
                 # Форматируем сравнение
                 comparison = await self.format_comparison(data1, data2)
-                await loading_msg.edit_text(comparison, parse_mode='Markdown')
+                await self.sender.edit(loading_msg, comparison, parse_mode='Markdown')
             else:
-                await loading_msg.edit_text(
+                await self.sender.edit(loading_msg,
                     f"❌ Не удалось получить данные для сравнения\n"
                     f"Проверьте правильность имен игроков."
                 )
                 
         except Exception as e:
             logger.error(f"Error in compare command: {e}")
-            await loading_msg.edit_text(
+            await self.sender.edit(loading_msg,
                 f"❌ Ошибка при сравнении игроков\n"
                 "Попробуйте позже или обратитесь к администратору."
             )
@@ -279,7 +470,7 @@ class WarThunderBot:
         region = context.args[0] if context.args else DEFAULT_REGION
         limit = min(int(context.args[1]) if len(context.args) > 1 else 10, 50)
         
-        loading_msg = await update.message.reply_text(f"🏆 Загружаю топ {limit} игроков...")
+        loading_msg = await self.sender.reply(update.message, f"🏆 Загружаю топ {limit} игроков...")
         
         try:
             url = f"{self.backend_url}/top"
@@ -302,13 +493,13 @@ class WarThunderBot:
                     top_message += f"{i}. **{username}**\n"
                     top_message += f"   Уровень: {level} | Винрейт: {winrate:.1%} | K/D: {kdr:.2f}\n\n"
                 
-                await loading_msg.edit_text(top_message, parse_mode='Markdown')
+                await self.sender.edit(loading_msg, top_message, parse_mode='Markdown')
             else:
-                await loading_msg.edit_text("❌ Не удалось получить топ игроков")
+                await self.sender.edit(loading_msg, "❌ Не удалось получить топ игроков")
                 
         except Exception as e:
             logger.error(f"Error in top command: {e}")
-            await loading_msg.edit_text("❌ Ошибка при получении топ игроков")
+            await self.sender.edit(loading_msg, "❌ Ошибка при получении топ игроков")
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /help"""
@@ -342,7 +533,7 @@ class WarThunderBot:
 • Проверьте регион сервера
 • При ошибках попробуйте позже
 """
-        await update.message.reply_text(help_text, parse_mode='Markdown')
+        await self.sender.reply(update.message, help_text, parse_mode='Markdown')
     
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка нажатий на кнопки"""
@@ -350,7 +541,7 @@ class WarThunderBot:
         await query.answer()
         
         if query.data == "get_stats":
-            await query.edit_message_text(
+            await self.sender.edit(query.message,
                 "📊 **Получить статистику**\n\n"
                 "Отправьте команду:\n"
                 "`/stats <имя_игрока>`\n\n"
@@ -358,7 +549,7 @@ class WarThunderBot:
                 parse_mode='Markdown'
             )
         elif query.data == "top_players":
-            await query.edit_message_text(
+            await self.sender.edit(query.message,
                 "🏆 **Топ игроков**\n\n"
                 "Отправьте команду:\n"
                 "`/top [регион] [количество]`\n\n"
@@ -366,7 +557,7 @@ class WarThunderBot:
                 parse_mode='Markdown'
             )
         elif query.data == "compare_players":
-            await query.edit_message_text(
+            await self.sender.edit(query.message,
                 "⚔️ **Сравнить игроков**\n\n"
                 "Отправьте команду:\n"
                 "`/compare <игрок1> <игрок2>`\n\n"
@@ -380,8 +571,12 @@ class WarThunderBot:
         """Обработка ошибок"""
         logger.error(f"Update {update} caused error {context.error}")
         
+        # На flood wait не отвечаем ещё одним сообщением, чтобы не раскручивать лимит
+        if isinstance(context.error, RetryAfter):
+            return
+        
         if update and update.effective_message:
-            await update.effective_message.reply_text(
+            await self.sender.reply(update.effective_message,
                 "❌ Произошла ошибка при обработке запроса.\n"
                 "Попробуйте позже или обратитесь к администратору."
             )
@@ -394,8 +589,9 @@ async def main():
     
     bot = WarThunderBot()
     
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Создаем приложение; апдейты обрабатываются параллельно, иначе ожидание
+    # очереди отправки в одном чате задерживало бы все остальные
+    application = Application.builder().token(BOT_TOKEN).concurrent_updates(True).build()
     
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", bot.start_command))
@@ -0,0 +1,147 @@
+"""
+Тесты очереди отправки бота: слияние правок, flood wait и повторы
+"""
+
+import time
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter, TimedOut, BadRequest
+
+import mini_app_bot
+from mini_app_bot import SendScheduler
+
+
+class FakeMessage:
+    def __init__(self, chat_id=1, message_id=10, failures=()):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.failures = list(failures)
+        self.calls = []
+
+    async def _call(self, kind, text):
+        self.calls.append((kind, text, time.monotonic()))
+        if self.failures:
+            raise self.failures.pop(0)
+        return f"{kind}:{text}"
+
+    async def reply_text(self, text, **kwargs):
+        return await self._call("reply", text)
+
+    async def edit_text(self, text, **kwargs):
+        return await self._call("edit", text)
+
+
+@pytest.fixture(autouse=True)
+def fast_limits(monkeypatch):
+    monkeypatch.setattr(mini_app_bot, "PRIVATE_CHAT_INTERVAL", 0.0)
+    monkeypatch.setattr(mini_app_bot, "GROUP_CHAT_INTERVAL", 0.0)
+
+
+def test_queued_edits_of_one_message_are_merged():
+    async def scenario():
+        scheduler = SendScheduler()
+        message = FakeMessage()
+        results = await asyncio.gather(*(scheduler.edit(message, f"v{i}") for i in range(5)))
+        return message, results
+
+    message, results = asyncio.run(scenario())
+
+    assert [call[:2] for call in message.calls] == [("edit", "v4")]
+    assert results == ["edit:v4"] * 5
+
+
+def test_send_tasks_are_referenced_until_done():
+    async def scenario():
+        scheduler = SendScheduler()
+        release = asyncio.Event()
+        message = FakeMessage()
+
+        async def slow_reply(text, **kwargs):
+            await release.wait()
+            return text
+
+        message.reply_text = slow_reply
+        reply = asyncio.create_task(scheduler.reply(message, "hello"))
+        await asyncio.sleep(0.05)
+        in_flight = len(scheduler.senders)
+        release.set()
+        result = await reply
+        await asyncio.sleep(0)
+        return in_flight, result, len(scheduler.senders)
+
+    assert asyncio.run(scenario()) == (1, "hello", 0)
+
+
+def test_edits_of_different_messages_are_not_merged():
+    async def scenario():
+        scheduler = SendScheduler()
+        first, second = FakeMessage(message_id=1), FakeMessage(message_id=2)
+        await asyncio.gather(scheduler.edit(first, "a"), scheduler.edit(second, "b"))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert [call[1] for call in first.calls] == ["a"]
+    assert [call[1] for call in second.calls] == ["b"]
+
+
+def test_retry_after_pauses_all_chats_and_resends():
+    async def scenario():
+        scheduler = SendScheduler()
+        flooded = FakeMessage(chat_id=1, failures=[RetryAfter(0.2)])
+        other = FakeMessage(chat_id=2)
+        first = asyncio.create_task(scheduler.reply(flooded, "hello"))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        second = await scheduler.reply(other, "world")
+        return flooded, other, await first, second, started
+
+    flooded, other, first, second, started = asyncio.run(scenario())
+
+    assert first == "reply:hello" and second == "reply:world"
+    assert len(flooded.calls) == 2
+    # Повтор и отправка в другой чат ждут окончания flood wait
+    flood_time = flooded.calls[0][2]
+    assert flooded.calls[1][2] - flood_time >= 0.2
+    assert other.calls[0][2] - flood_time >= 0.2
+    assert other.calls[0][2] >= started
+
+
+def test_timed_out_reply_is_not_retried():
+    async def scenario():
+        scheduler = SendScheduler()
+        message = FakeMessage(failures=[TimedOut()])
+        with pytest.raises(TimedOut):
+            await scheduler.reply(message, "hello")
+        return message
+
+    message = asyncio.run(scenario())
+
+    assert len(message.calls) == 1
+
+
+def test_timed_out_edit_is_retried(monkeypatch):
+    monkeypatch.setattr(SendScheduler, "_backoff", lambda self, job: None)
+
+    async def scenario():
+        scheduler = SendScheduler()
+        message = FakeMessage(failures=[TimedOut()])
+        return message, await scheduler.edit(message, "v1")
+
+    message, result = asyncio.run(scenario())
+
+    assert result == "edit:v1"
+    assert len(message.calls) == 2
+
+
+def test_not_modified_edit_is_not_an_error():
+    async def scenario():
+        scheduler = SendScheduler()
+        message = FakeMessage(failures=[BadRequest("Message is not modified")])
+        return message, await scheduler.edit(message, "same")
+
+    message, result = asyncio.run(scenario())
+
+    assert result is None
+    assert len(message.calls) == 1